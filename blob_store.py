@@ -0,0 +1,78 @@
+"""
+Хранилище страниц по содержимому (content-addressed)
+
+Загрузка кладет HTML в хранилище и передает дальше по цепочке маленький
+handle {"blob": sha256, "bytes": размер} вместо самой страницы - через брокер
+и result backend идет несколько десятков байт. Задачи ниже по цепочке читают
+страницу по handle только когда она им нужна (load_html).
+
+BLOB_DIR - локальный каталог или общий том (NFS) для воркеров на разных
+хостах. Одинаковые страницы хранятся один раз; старые blobs удаляются
+prune_blobs() (периодическая задача).
+"""
+
+import gzip
+import hashlib
+import os
+import time
+
+BLOB_DIR = os.environ.get("BLOB_DIR", "./storage/blobs")
+BLOB_TTL = int(os.environ.get("BLOB_TTL", 7 * 24 * 3600))
+
+
+def _path(digest: str) -> str:
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:4], f"{digest}.html.gz")
+
+
+def is_handle(value) -> bool:
+    return isinstance(value, dict) and "blob" in value
+
+
+def put_blob(content: str) -> dict:
+    data = content.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    path = _path(digest)
+
+    if os.path.exists(path):
+        # Уже есть - только продлеваем жизнь
+        os.utime(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=5) as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    return {"blob": digest, "bytes": len(data)}
+
+
+def get_blob(handle: dict) -> str:
+    with gzip.open(_path(handle["blob"]), "rb") as file:
+        return file.read().decode("utf-8")
+
+
+def load_html(html_or_handle) -> str:
+    """
+    HTML из handle; строка (старые цепочки, прямые вызовы) возвращается как есть
+    """
+    if is_handle(html_or_handle):
+        return get_blob(html_or_handle)
+    return html_or_handle
+
+
+def prune_blobs(max_age: int = BLOB_TTL) -> int:
+    """
+    Удалить blobs, к которым не обращались дольше max_age сек
+    """
+    removed = 0
+    deadline = time.time() - max_age
+    for root, _, files in os.walk(BLOB_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
@@ -0,0 +1,328 @@
+"""
+Пул браузеров Celery воркера
+
+Каждый процесс воркера при старте (worker_process_init) создает пул до N
+"теплых" UC браузеров и выдает их задачам в аренду. Браузеры (и дисплей)
+поднимаются при первых арендах: процесс должен отчитаться мастеру за
+worker_proc_alive_timeout, а старт Chrome с прогревом профиля дольше.
+Между арендами браузер сбрасывается: закрываются лишние вкладки, очищаются
+storage и кэш, cookies сохраняются. Браузер пересоздается после
+BROWSER_MAX_PAGES страниц или при превышении BROWSER_MAX_MEMORY_MB. Дисплей
+берется у display_manager и проверяется перед каждой арендой, профиль Chrome -
+у profile_manager (прогретый заранее).
+"""
+
+import os
+import queue
+import signal
+import threading
+from contextlib import contextmanager
+
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_process_init, worker_process_shutdown
+from seleniumbase import SB
+
+from display_manager import acquire_display, display_session
+from interception import clear_interception
+from profile_manager import lease_profile, profile_session, ensure_warm
+from time_budget import browser_kill_delay
+
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", 1))
+BROWSER_MAX_PAGES = int(os.environ.get("BROWSER_MAX_PAGES", 200))
+BROWSER_MAX_MEMORY_MB = int(os.environ.get("BROWSER_MAX_MEMORY_MB", 1500))
+BROWSER_LEASE_TIMEOUT = int(os.environ.get("BROWSER_LEASE_TIMEOUT", 300))
+
+DEFAULT_SB_KWARGS = {"uc": True, "headless": False, "block_images": False}
+
+
+def _process_tree(pid: int) -> list:
+    """
+    Процесс и все его потомки (по /proc), родители раньше потомков
+    """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as file:
+                stat = file.read()
+            ppid = int(stat.rsplit(")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    tree = []
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def _process_tree_rss_mb(pid: int) -> float:
+    """
+    Суммарный RSS процесса и всех его потомков, в мегабайтах
+    """
+    total_kb = 0
+    for current in _process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status", "r") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+
+    return total_kb / 1024
+
+
+class BrowserSession:
+    """
+    Долгоживущий SB браузер, который переиспользуется между задачами
+    """
+
+    def __init__(self, **sb_kwargs):
+        self.sb_kwargs = sb_kwargs
+        self.sb = None
+        self.pages = 0
+        self.retired = False
+        self.profile = None
+        self._context = None
+
+    def start(self):
+        # Профиль держим за сессией и между пересозданиями браузера
+        if self.profile is None:
+            self.profile = lease_profile()
+        self._context = SB(user_data_dir=self.profile.path, **self.sb_kwargs)
+        self.sb = self._context.__enter__()
+        self.pages = 0
+        self.retired = False
+        ensure_warm(self.sb, self.profile)
+        return self
+
+    def stop(self):
+        if self._context is None:
+            return
+        try:
+            self._context.__exit__(None, None, None)
+        except Exception as e:
+            print(f"Ошибка закрытия браузера: {e}")
+        self._context = None
+        self.sb = None
+
+    def restart(self):
+        self.stop()
+        return self.start()
+
+    def close(self):
+        self.stop()
+        if self.profile is not None:
+            self.profile.release()
+            self.profile = None
+
+    def retire(self):
+        """
+        Пометить браузер на пересоздание после возврата в пул
+        """
+        self.retired = True
+
+    def kill(self):
+        """
+        Убить процессы браузера и chromedriver (задача зависла в вызове браузера):
+        зависший вызов WebDriver получит ошибку, браузер пересоздается при возврате в пул
+        """
+        self.retired = True
+        if self.sb is None:
+            return
+        driver = self.sb.driver
+        roots = []
+        if getattr(driver, "browser_pid", None):
+            # UC режим запускает Chrome отдельно от chromedriver
+            roots.append(driver.browser_pid)
+        try:
+            roots.append(driver.service.process.pid)
+        except AttributeError:
+            pass
+        print(f"Бюджет времени задачи исчерпан, браузер убит: {roots}")
+        for root in roots:
+            for pid in reversed(_process_tree(root)):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def memory_mb(self) -> float:
+        driver = self.sb.driver
+        pid = getattr(driver, "browser_pid", None) or driver.service.process.pid
+        return _process_tree_rss_mb(pid)
+
+    def needs_recycle(self) -> bool:
+        if self.retired or self.pages >= BROWSER_MAX_PAGES:
+            return True
+        try:
+            return self.memory_mb() > BROWSER_MAX_MEMORY_MB
+        except Exception:
+            return False
+
+    def reset(self):
+        """
+        Вернуть браузер в чистое состояние: одна вкладка, пустая страница,
+        без localStorage/sessionStorage, кэша и блокировок. Cookies не трогаем
+        """
+        driver = self.sb.driver
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        try:
+            driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+        except Exception:
+            pass
+        try:
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        except Exception:
+            pass
+        clear_interception(self.sb)
+
+        driver.get("about:blank")
+
+
+class BrowserPool:
+    """
+    Пул браузеров одного процесса воркера
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, **sb_kwargs):
+        self.size = size
+        self.sb_kwargs = {**DEFAULT_SB_KWARGS, **sb_kwargs}
+        self._idle = queue.Queue()
+        self._sessions = []
+        self._display = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Браузеры запускаются при аренде (_grow) - здесь ничего долгого
+        print(f"Пул браузеров создан: до {self.size} шт.")
+
+    def _grow(self):
+        """
+        Запустить еще один браузер, пока пул не заполнен. None - пул уже полон
+        """
+        with self._lock:
+            if len(self._sessions) >= self.size:
+                return None
+            if self._display is None:
+                self._display = acquire_display()
+                print(f'Display: {self._display.name}')
+            session = BrowserSession(**self.sb_kwargs)
+            self._sessions.append(session)
+        try:
+            return session.start()
+        except BaseException:
+            with self._lock:
+                self._sessions.remove(session)
+            session.close()
+            raise
+
+    def stop(self):
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            if self._display is not None:
+                self._display.release()
+                self._display = None
+
+    def accepts(self, sb_kwargs: dict) -> bool:
+        """
+        Подходит ли браузер из пула под запрошенные параметры SB
+        """
+        return all(self.sb_kwargs.get(key) == value for key, value in sb_kwargs.items())
+
+    @contextmanager
+    def lease(self, timeout: int = BROWSER_LEASE_TIMEOUT):
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            session = self._grow() or self._idle.get(timeout=timeout)
+        if not self._display.ensure():
+            # Xvfb перезапущен - браузер на старом дисплее уже мертв
+            session.restart()
+        # Сторож hard лимита задачи (time_budget.py)
+        kill_delay = browser_kill_delay()
+        watchdog = threading.Timer(kill_delay, session.kill) if kill_delay is not None else None
+        if watchdog is not None:
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            yield session
+        except SoftTimeLimitExceeded:
+            # Задача прервана посреди работы с браузером - состояние страницы неизвестно
+            session.retire()
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            self._release(session)
+
+    def _release(self, session: BrowserSession):
+        session.pages += 1
+        try:
+            if session.needs_recycle():
+                print(f"Пересоздание браузера после {session.pages} страниц")
+                session.restart()
+            else:
+                session.reset()
+        except Exception as e:
+            print(f"Ошибка сброса браузера, пересоздаем: {e}")
+            session.restart()
+        self._idle.put(session)
+
+
+_pool = None
+
+
+def get_pool():
+    return _pool
+
+
+@worker_process_init.connect
+def init_worker_browser_pool(**kwargs):
+    global _pool
+    if BROWSER_POOL_SIZE <= 0:
+        return
+    _pool = BrowserPool(BROWSER_POOL_SIZE)
+    _pool.start()
+
+
+@worker_process_shutdown.connect
+def stop_worker_browser_pool(**kwargs):
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
+
+
+@contextmanager
+def browser_session(**sb_kwargs):
+    """
+    Получить браузер: из пула воркера, если он запущен и параметры совпадают,
+    иначе временный браузер на время блока with
+    """
+    sb_kwargs = {**DEFAULT_SB_KWARGS, **sb_kwargs}
+
+    if _pool is not None and _pool.accepts(sb_kwargs):
+        with _pool.lease() as session:
+            yield session.sb
+        return
+
+    with display_session() as display, profile_session() as profile:
+        print(f'Display: {display.name}, profile: {profile.index}')
+
+        with SB(user_data_dir=profile.path, **sb_kwargs) as sb:
+            ensure_warm(sb, profile)
+            yield sb
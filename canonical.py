@@ -0,0 +1,106 @@
+"""
+Канонический вид URL, ключ parcel и стабильный ID
+
+Один и тот же parcel приходит с разным регистром хоста, порядком параметров,
+якорями и служебными параметрами. canonical_url() приводит такие URL к одному
+виду (с учетом служебных параметров платформы), parcel_key() достает из URL
+сам parcel ("qpublic:<AppID>:<KeyValue>"), а parcel_id() дает по нему
+стабильный ID - keyed BLAKE2, одинаковый на всех воркерах и при любом
+перезапуске (в отличие от hash()). Frontier, имена файлов и импорт в базу
+ключуются этим ID, поэтому повторный обход обновляет те же записи.
+"""
+
+import hashlib
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Служебные параметры, не влияющие на содержимое страницы
+IGNORED_PARAMS = {
+    "utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content",
+    "fbclid", "gclid", "sessionid", "_",
+}
+
+# То же по платформам (Schneider добавляет к ссылкам случайный Q=...)
+PLATFORM_IGNORED_PARAMS = {
+    "qpublic": {"q"},
+    "beacon": {"q"},
+}
+
+# Где в URL ключ parcel: county - параметр округа (если все округа на одном хосте),
+# param - параметр с номером parcel, path - регулярка пути с номером в первой группе
+PARCEL_KEY_RULES = {
+    "qpublic": {"county": "appid", "param": "keyvalue"},
+    "beacon": {"county": "appid", "param": "keyvalue"},
+    "tyler": {"param": "parcelid"},
+    "bid4assets": {"path": re.compile(r"/item/(?:\w+/)*(\d+)", re.IGNORECASE)},
+}
+
+# Ключ BLAKE2: ID не угадываются по номеру parcel; сменить ключ - сменить все ID
+PARCEL_ID_KEY = os.environ.get("PARCEL_ID_KEY", "taxlien-parcel").encode("utf-8")
+PARCEL_ID_SIZE = 10  # байт, ID - 20 hex символов
+
+
+def detect_platform(url: str):
+    host = urlsplit(url).netloc.lower()
+    if "qpublic" in host:
+        return "qpublic"
+    if "beacon" in host:
+        return "beacon"
+    if "bid4assets" in host:
+        return "bid4assets"
+    return None
+
+
+def canonical_url(url: str, platform: str = None) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "https"
+    host = parts.netloc.lower()
+    if host.endswith(":443") and scheme == "https" or host.endswith(":80") and scheme == "http":
+        host = host.rsplit(":", 1)[0]
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    ignored = IGNORED_PARAMS | PLATFORM_IGNORED_PARAMS.get(platform or detect_platform(url), set())
+    params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in ignored]
+    query = urlencode(sorted(params))
+
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def parcel_key(url: str, platform: str = None):
+    """
+    Ключ parcel "<platform>:[<округ>:]<номер>" или None, если URL не страница parcel
+    """
+    platform = platform or detect_platform(url)
+    rule = PARCEL_KEY_RULES.get(platform)
+    if rule is None:
+        return None
+
+    parts = urlsplit(url.strip())
+    params = {k.lower(): v.strip() for k, v in parse_qsl(parts.query)}
+    if "path" in rule:
+        match = rule["path"].search(parts.path)
+        number = match.group(1) if match else None
+    else:
+        number = params.get(rule["param"])
+    if not number:
+        return None
+
+    scope = [platform]
+    if rule.get("county"):
+        scope.append(params.get(rule["county"], ""))
+    elif "path" not in rule:
+        # Округа на разных хостах
+        scope.append(parts.netloc.lower())
+    return ":".join(scope + [number.replace(" ", "").upper()])
+
+
+def parcel_id(url: str, platform: str = None) -> str:
+    """
+    Стабильный ID parcel: от ключа parcel, а если его нет - от канонического URL
+    """
+    key = parcel_key(url, platform) or canonical_url(url, platform)
+    return hashlib.blake2b(key.encode("utf-8"), key=PARCEL_ID_KEY, digest_size=PARCEL_ID_SIZE).hexdigest()
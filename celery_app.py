@@ -1,3 +1,20 @@
+import os
+
+import redis
 from celery import Celery
 
-app = Celery('app', broker='redis://localhost:6379/0')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+app = Celery('app', broker=REDIS_URL)
+
+_redis = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    Общий клиент Redis для кэшей и счетчиков (тот же инстанс, что и брокер)
+    """
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
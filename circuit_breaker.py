@@ -0,0 +1,165 @@
+"""
+Circuit breaker по хосту (общий для всех воркеров через Redis)
+
+Ключ - rate_limiter.rate_key: хост или хост + округ. После
+BREAKER_FAILURE_THRESHOLD ошибок подряд (в пределах BREAKER_WINDOW) breaker
+открывается: загрузки этого ключа сразу получают CircuitOpen и не запускают
+браузер, а диспетчер frontier откладывает записи хоста (park). Через
+BREAKER_COOLDOWN один запрос пропускается пробой (half-open): успех закрывает
+breaker, неудача открывает снова. Проба, которая не вернулась за
+BREAKER_PROBE_TIMEOUT (умер воркер), передается следующему запросу.
+
+Ошибками считаются транзитные и blocked исходы (outcomes.py); 404, паузы
+лимитера и нехватка слотов на состояние не влияют.
+
+Состояние: hash breaker:<key> (state, until, failures, since, probe).
+"""
+
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+from celery_app import get_redis
+from concurrency import NoCapacity
+from outcomes import classify, TRANSIENT, BLOCKED
+from rate_limiter import rate_key, RateLimited
+from redis_scripts import script, NOW_MS_LUA
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_WINDOW = int(os.environ.get("BREAKER_WINDOW", 120))  # сек, окно подсчета ошибок
+BREAKER_COOLDOWN = int(os.environ.get("BREAKER_COOLDOWN", 300))  # сек до пробы
+BREAKER_PROBE_TIMEOUT = int(os.environ.get("BREAKER_PROBE_TIMEOUT", 300))
+BREAKER_STATE_TTL = 24 * 3600
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# KEYS[1] - состояние; ARGV: token, probe_timeout_ms.
+# 0 - можно (closed), -1 - можно, этот запрос - проба, > 0 - сколько мс ждать
+ALLOW_LUA = NOW_MS_LUA + """
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state or state == 'closed' then return 0 end
+local wait = (tonumber(redis.call('HGET', KEYS[1], 'until')) or 0) - now
+if wait > 0 then return wait end
+redis.call('HSET', KEYS[1], 'state', 'half_open', 'until', now + tonumber(ARGV[2]), 'probe', ARGV[1])
+return -1
+"""
+
+# KEYS[1]; ARGV: outcome (ok | fail | skip), token, threshold, window_ms, cooldown_ms, ttl_ms.
+# Возвращает состояние после записи
+RECORD_LUA = NOW_MS_LUA + """
+local key = KEYS[1]
+local outcome = ARGV[1]
+local state = redis.call('HGET', key, 'state') or 'closed'
+local is_probe = state == 'half_open' and redis.call('HGET', key, 'probe') == ARGV[2]
+
+if state == 'half_open' then
+    -- Результаты запросов, начатых до открытия, пробой не считаются
+    if not is_probe then return state end
+    if outcome == 'ok' then
+        redis.call('DEL', key)
+        return 'closed'
+    elseif outcome == 'skip' then
+        redis.call('HSET', key, 'until', now)
+        return state
+    end
+    redis.call('HSET', key, 'state', 'open', 'until', now + tonumber(ARGV[5]), 'failures', 0)
+    return 'open'
+end
+if state == 'open' or outcome == 'skip' then return state end
+
+if outcome == 'ok' then
+    redis.call('DEL', key)
+    return 'closed'
+end
+local since = tonumber(redis.call('HGET', key, 'since')) or 0
+if now - since > tonumber(ARGV[4]) then
+    redis.call('HSET', key, 'failures', 0, 'since', now)
+end
+local failures = redis.call('HINCRBY', key, 'failures', 1)
+redis.call('PEXPIRE', key, tonumber(ARGV[6]))
+if failures >= tonumber(ARGV[3]) then
+    redis.call('HSET', key, 'state', 'open', 'until', now + tonumber(ARGV[5]))
+    return 'open'
+end
+return 'closed'
+"""
+
+
+class CircuitOpen(Exception):
+    """
+    Breaker хоста открыт; повторить не раньше чем через retry_after сек
+    """
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"Хост {key} недоступен (circuit open), повтор через {retry_after:.0f} сек")
+        self.key = key
+        self.retry_after = retry_after
+
+
+def breaker_key(url: str) -> str:
+    return rate_key(url)
+
+
+def breaker_state(url: str):
+    """
+    (состояние, сколько сек до пробы) без изменения состояния - для диспетчера
+    """
+    try:
+        state, until = get_redis().hmget(f"breaker:{breaker_key(url)}", "state", "until")
+    except redis.RedisError:
+        return CLOSED, 0
+    if not state or state == CLOSED:
+        return CLOSED, 0
+    return state, max(0.0, float(until or 0) / 1000 - time.time())
+
+
+def _record(key: str, outcome: str, token: str):
+    try:
+        state = script(RECORD_LUA)(
+            keys=[f"breaker:{key}"],
+            args=[outcome, token, BREAKER_FAILURE_THRESHOLD, BREAKER_WINDOW * 1000, BREAKER_COOLDOWN * 1000,
+                  BREAKER_STATE_TTL * 1000])
+    except redis.RedisError:
+        return
+    if state == OPEN and outcome == "fail":
+        print(f"Circuit breaker открыт для {key} на {BREAKER_COOLDOWN} сек")
+    elif state == CLOSED and outcome == "ok" and token:
+        print(f"Circuit breaker закрыт для {key}")
+
+
+@contextmanager
+def circuit(url: str):
+    """
+    Пропустить загрузку через breaker хоста и записать ее исход.
+    Открыт - CircuitOpen без обращения к сайту
+    """
+    key = breaker_key(url)
+    token = uuid.uuid4().hex
+    try:
+        wait_ms = script(ALLOW_LUA)(keys=[f"breaker:{key}"], args=[token, BREAKER_PROBE_TIMEOUT * 1000])
+    except redis.RedisError:
+        # Без Redis breaker не действует
+        wait_ms = None
+    if wait_ms is not None and wait_ms > 0:
+        raise CircuitOpen(key, wait_ms / 1000)
+    if wait_ms == -1:
+        print(f"Circuit breaker {key}: пробный запрос")
+
+    outcome = "fail"
+    try:
+        yield
+        outcome = "ok"
+    except Exception as e:
+        # Паузы лимитера и нехватка слотов - не отказ сайта
+        neutral = isinstance(e, (RateLimited, NoCapacity))
+        outcome = "fail" if not neutral and classify(e).kind in (TRANSIENT, BLOCKED) else "skip"
+        raise
+    finally:
+        if wait_ms is not None:
+            _record(key, outcome, token if wait_ms == -1 else "")
+
@@ -0,0 +1,199 @@
+"""
+Кэш Cloudflare clearance
+
+Браузер проходит challenge один раз на хост и выгружает cookies и User-Agent
+в общее хранилище (Redis, а в dev - локальные файлы). Дальше страницы этого
+хоста забираются обычным requests.Session с этими cookies, пока clearance
+не истечет или сайт снова не покажет challenge - тогда нужен браузер.
+
+cf_clearance привязан к IP, поэтому воркеры с разными внешними адресами
+(прокси) должны иметь разный CLEARANCE_SCOPE.
+"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from celery_app import get_redis
+from rate_limiter import check_throttled
+
+CLEARANCE_STORE = os.environ.get("CLEARANCE_STORE", "redis")  # redis | file
+CLEARANCE_DIR = os.environ.get("CLEARANCE_DIR", "./storage/clearance")
+CLEARANCE_SCOPE = os.environ.get("CLEARANCE_SCOPE", "default")
+CLEARANCE_TTL = int(os.environ.get("CLEARANCE_TTL", 30 * 60))
+HTTP_TIMEOUT = 30
+
+# Хосты, где страницы закрыты Cloudflare и clearance имеет смысл
+CLEARANCE_HOSTS = [
+    "qpublic.schneidercorp.com",
+    "beacon.schneidercorp.com",
+]
+
+CHALLENGE_MARKERS = [
+    "just a moment...",
+    "cf-challenge",
+    "challenge-platform",
+]
+
+
+def get_host(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+def uses_clearance(url: str) -> bool:
+    host = get_host(url)
+    return any(host == item or host.endswith("." + item) for item in CLEARANCE_HOSTS)
+
+
+def is_challenge_response(response: requests.Response) -> bool:
+    if response.headers.get("cf-mitigated") == "challenge":
+        return True
+    text = response.text[:5000].lower()
+    if "<title>just a moment" in text:
+        return True
+    if response.status_code in (403, 429, 503):
+        return any(marker in text for marker in CHALLENGE_MARKERS)
+    return False
+
+
+class RedisClearanceStore:
+
+    def _key(self, host: str) -> str:
+        return f"clearance:{CLEARANCE_SCOPE}:{host}"
+
+    def get(self, host: str):
+        value = get_redis().get(self._key(host))
+        return json.loads(value) if value else None
+
+    def put(self, host: str, clearance: dict, ttl: int):
+        get_redis().set(self._key(host), json.dumps(clearance), ex=ttl)
+
+    def invalidate(self, host: str):
+        get_redis().delete(self._key(host))
+
+
+class FileClearanceStore:
+
+    def _path(self, host: str) -> str:
+        return os.path.join(CLEARANCE_DIR, CLEARANCE_SCOPE, f"{host}.json")
+
+    def get(self, host: str):
+        try:
+            with open(self._path(host), "r", encoding="utf-8") as file:
+                clearance = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if clearance.get("expires_at", 0) <= time.time():
+            return None
+        return clearance
+
+    def put(self, host: str, clearance: dict, ttl: int):
+        path = self._path(host)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(clearance, file)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, host: str):
+        try:
+            os.remove(self._path(host))
+        except OSError:
+            pass
+
+
+store = FileClearanceStore() if CLEARANCE_STORE == "file" else RedisClearanceStore()
+
+
+def export_clearance(sb, url: str) -> dict:
+    """
+    Выгрузить cookies и User-Agent браузера, прошедшего challenge, в хранилище
+    """
+    host = get_host(url)
+    cookies = sb.driver.get_cookies()
+    user_agent = sb.execute_script("return navigator.userAgent;")
+
+    ttl = CLEARANCE_TTL
+    for cookie in cookies:
+        if cookie.get("name") == "cf_clearance" and cookie.get("expiry"):
+            ttl = min(ttl, int(cookie["expiry"] - time.time()))
+
+    clearance = {
+        "host": host,
+        "user_agent": user_agent,
+        "cookies": [
+            {"name": c["name"], "value": c["value"], "domain": c.get("domain"), "path": c.get("path", "/")}
+            for c in cookies
+        ],
+        "created_at": time.time(),
+        "expires_at": time.time() + ttl,
+    }
+
+    if ttl > 0:
+        store.put(host, clearance, ttl)
+        print(f"Clearance сохранен: {host} ({ttl} сек)")
+
+    return clearance
+
+
+# Пул HTTP сессий процесса: одна сессия на хост, пересоздается при смене clearance
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(host: str, clearance: dict) -> requests.Session:
+    with _sessions_lock:
+        cached = _sessions.get(host)
+        if cached and cached[0] == clearance["created_at"]:
+            return cached[1]
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "User-Agent": clearance["user_agent"],
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9",
+        })
+        for cookie in clearance["cookies"]:
+            session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+
+        if cached:
+            cached[1].close()
+        _sessions[host] = (clearance["created_at"], session)
+        return session
+
+
+def fetch_with_clearance(url: str):
+    """
+    Забрать страницу по HTTP с сохраненным clearance.
+    Возвращает HTML или None, если clearance нет/истек и нужен браузер
+    """
+    host = get_host(url)
+    clearance = store.get(host)
+    if clearance is None:
+        return None
+
+    session = _get_session(host, clearance)
+    try:
+        response = session.get(url, timeout=HTTP_TIMEOUT, allow_redirects=True)
+    except requests.RequestException as e:
+        print(f"HTTP ошибка {url}: {e}")
+        return None
+
+    if is_challenge_response(response):
+        print(f"Clearance для {host} больше не действует")
+        store.invalidate(host)
+        return None
+
+    check_throttled(url, response)
+    if response.status_code != 200:
+        return None
+
+    return response.text
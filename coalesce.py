@@ -0,0 +1,92 @@
+"""
+Объединение одновременных загрузок одного URL (single flight) и короткий кэш результатов
+
+Один parcel может оказаться в очереди дважды (перебор округа + ручной
+перезапуск, пересекающиеся запуски по расписанию). Первая задача занимает URL
+(SET NX по каноническому ключу, canonical.py) и загружает страницу, вторая
+получает InFlight и перезапускается через COALESCE_RETRY_DELAY - к этому
+времени результат первой уже лежит в кэше (FETCH_CACHE_TTL) и возвращается
+без браузера. Блокировка живет FETCH_INFLIGHT_TTL, поэтому умерший воркер
+не держит URL вечно.
+
+В кэше лежит то, что задача передает дальше по цепочке: handle blob_store
+или извлеченная запись. Неудачи не кэшируются.
+
+Ключи Redis: fetch_cache:<kind>:<url>, fetch_inflight:<kind>:<url>
+"""
+
+import json
+import os
+import uuid
+
+import redis
+
+from canonical import canonical_url
+from celery_app import get_redis
+from redis_scripts import script
+
+FETCH_CACHE_TTL = int(os.environ.get("FETCH_CACHE_TTL", 600))
+FETCH_INFLIGHT_TTL = int(os.environ.get("FETCH_INFLIGHT_TTL", 900))
+COALESCE_RETRY_DELAY = int(os.environ.get("COALESCE_RETRY_DELAY", 15))
+
+# KEYS[1] - кэш, KEYS[2] - блокировка; ARGV: value, cache_ttl, token.
+# Кэш пишется всегда, блокировка снимается только своя
+PUBLISH_LUA = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+if redis.call('GET', KEYS[2]) == ARGV[3] then redis.call('DEL', KEYS[2]) end
+"""
+
+RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then redis.call('DEL', KEYS[1]) end
+"""
+
+
+class InFlight(Exception):
+    """
+    URL уже загружается другой задачей; повторить через retry_after сек и взять результат из кэша
+    """
+
+    def __init__(self, key: str, retry_after: float = COALESCE_RETRY_DELAY):
+        super().__init__(f"{key} уже загружается, повтор через {retry_after:.0f} сек")
+        self.key = key
+        self.retry_after = retry_after
+
+
+def _keys(kind: str, url: str):
+    key = canonical_url(url)
+    return f"fetch_cache:{kind}:{key}", f"fetch_inflight:{kind}:{key}"
+
+
+def coalesce(kind: str, url: str, produce):
+    """
+    Результат produce() для url с объединением одновременных вызовов.
+    kind разделяет разные результаты одного URL ("page", "record")
+    """
+    cache_key, lock_key = _keys(kind, url)
+    token = uuid.uuid4().hex
+    try:
+        r = get_redis()
+        cached = r.get(cache_key)
+        if cached is not None:
+            print(f"Из кэша загрузок: {url}")
+            return json.loads(cached)
+        if not r.set(lock_key, token, nx=True, ex=FETCH_INFLIGHT_TTL):
+            raise InFlight(lock_key)
+    except redis.RedisError:
+        # Без Redis просто загружаем
+        return produce()
+
+    try:
+        value = produce()
+    except BaseException:
+        try:
+            script(RELEASE_LUA)(keys=[lock_key], args=[token])
+        except redis.RedisError:
+            pass
+        raise
+
+    try:
+        script(PUBLISH_LUA)(keys=[cache_key, lock_key], args=[json.dumps(value), FETCH_CACHE_TTL, token])
+    except redis.RedisError:
+        pass
+    return value
@@ -0,0 +1,197 @@
+"""
+Адаптивный лимит одновременных загрузок по хосту (AIMD)
+
+Для каждого ключа хоста (rate_limiter.rate_key: хост или хост + округ) в Redis
+хранится допустимое число одновременных загрузок. Пока сайт отвечает
+нормально, лимит растет аддитивно (+AIMD_INCREASE за "окно" из limit успешных
+загрузок), при ошибке, challenge, 429 или замедлении (латентность больше
+AIMD_SLOW_FACTOR средней) - делится на AIMD_DECREASE, не чаще раза в AIMD_COOLDOWN.
+
+Слоты занимаются задачами через host_slot(); свободного слота нет - NoCapacity,
+и задача перезапускается позже. Слоты живут в Redis с TTL, поэтому умерший
+воркер не "съедает" лимит навсегда.
+
+Текущий лимит отдается в Prometheus (taxlien_host_concurrency_limit) HTTP
+сервером главного процесса воркера на порту METRICS_PORT.
+"""
+
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+from celery.signals import worker_init
+from prometheus_client import start_http_server, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+from celery_app import get_redis
+from rate_limiter import rate_key, RateLimited
+from redis_scripts import script, NOW_MS_LUA
+
+CONCURRENCY_INITIAL = float(os.environ.get("CONCURRENCY_INITIAL", 2))
+CONCURRENCY_MIN = float(os.environ.get("CONCURRENCY_MIN", 1))
+CONCURRENCY_MAX = float(os.environ.get("CONCURRENCY_MAX", 16))
+AIMD_INCREASE = float(os.environ.get("AIMD_INCREASE", 1))
+AIMD_DECREASE = float(os.environ.get("AIMD_DECREASE", 0.5))
+AIMD_SLOW_FACTOR = float(os.environ.get("AIMD_SLOW_FACTOR", 3))
+AIMD_COOLDOWN = int(os.environ.get("AIMD_COOLDOWN", 30))  # сек между снижениями лимита
+CONCURRENCY_SLOT_TTL = int(os.environ.get("CONCURRENCY_SLOT_TTL", 600))
+CONCURRENCY_RETRY_DELAY = 5  # сек до повторной попытки занять слот
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))  # 0 - не поднимать сервер метрик
+
+# KEYS[1] - состояние, KEYS[2] - занятые слоты (zset token -> истечение); ARGV: token, ttl_ms, initial
+ACQUIRE_LUA = NOW_MS_LUA + """
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit')) or tonumber(ARGV[3])
+if redis.call('ZCARD', KEYS[2]) < math.max(1, math.floor(limit)) then
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), ARGV[1])
+    redis.call('PEXPIRE', KEYS[2], tonumber(ARGV[2]))
+    return 1
+end
+return 0
+"""
+
+# ARGV: token, outcome, latency_ms, initial, min, max, increase, decrease, slow_factor, cooldown_ms
+RELEASE_LUA = NOW_MS_LUA + """
+redis.call('ZREM', KEYS[2], ARGV[1])
+local outcome = ARGV[2]
+if outcome == 'skip' then return nil end
+
+local latency = tonumber(ARGV[3])
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit')) or tonumber(ARGV[4])
+local avg = tonumber(redis.call('HGET', KEYS[1], 'latency_ms'))
+local cut_at = tonumber(redis.call('HGET', KEYS[1], 'cut_at')) or 0
+
+if outcome == 'ok' then
+    if avg and latency > avg * tonumber(ARGV[9]) then outcome = 'slow' end
+    avg = avg and (avg * 0.8 + latency * 0.2) or latency
+    redis.call('HSET', KEYS[1], 'latency_ms', avg)
+end
+
+if outcome == 'ok' then
+    limit = math.min(tonumber(ARGV[6]), limit + tonumber(ARGV[7]) / limit)
+elseif now - cut_at >= tonumber(ARGV[10]) then
+    limit = math.max(tonumber(ARGV[5]), limit * tonumber(ARGV[8]))
+    redis.call('HSET', KEYS[1], 'cut_at', now)
+end
+
+redis.call('HSET', KEYS[1], 'limit', limit)
+redis.call('HINCRBY', KEYS[1], outcome, 1)
+return tostring(limit)
+"""
+
+
+class NoCapacity(Exception):
+    """
+    Все слоты хоста заняты; задачу нужно запустить позже
+    """
+
+    def __init__(self, key: str, retry_after: float = CONCURRENCY_RETRY_DELAY):
+        super().__init__(f"Нет свободных слотов для {key}")
+        self.key = key
+        self.retry_after = retry_after
+
+
+# Ключи, на которых браузер встретил challenge во время текущей загрузки
+_challenged = set()
+
+
+def _keys(key: str) -> list:
+    return [f"concurrency:state:{key}", f"concurrency:inflight:{key}"]
+
+
+def current_limit(url: str) -> int:
+    try:
+        limit = get_redis().hget(_keys(rate_key(url))[0], "limit")
+    except redis.RedisError:
+        limit = None
+    return max(1, int(float(limit or CONCURRENCY_INITIAL)))
+
+
+def note_challenge(url: str):
+    """
+    Отметить challenge, встреченный браузером: сигнал к снижению лимита хоста
+    """
+    _challenged.add(rate_key(url))
+
+
+def _release(key: str, token: str, outcome: str, latency: float):
+    try:
+        limit = script(RELEASE_LUA)(keys=_keys(key), args=[
+            token, outcome, int(latency * 1000), CONCURRENCY_INITIAL, CONCURRENCY_MIN, CONCURRENCY_MAX,
+            AIMD_INCREASE, AIMD_DECREASE, AIMD_SLOW_FACTOR, AIMD_COOLDOWN * 1000,
+        ])
+    except redis.RedisError:
+        return
+    if outcome != "ok" and limit is not None:
+        print(f"Лимит одновременных загрузок {key}: {float(limit):.2f} ({outcome})")
+
+
+@contextmanager
+def host_slot(url: str):
+    """
+    Занять слот хоста на время загрузки и по ее исходу скорректировать лимит
+    """
+    key = rate_key(url)
+    token = uuid.uuid4().hex
+    try:
+        acquired = script(ACQUIRE_LUA)(keys=_keys(key),
+                                       args=[token, CONCURRENCY_SLOT_TTL * 1000, CONCURRENCY_INITIAL])
+    except redis.RedisError:
+        # Без Redis работаем без ограничения
+        acquired = None
+    if acquired == 0:
+        raise NoCapacity(key)
+
+    _challenged.discard(key)
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "challenge" if key in _challenged else "ok"
+    except RateLimited as e:
+        # Пауза нашего лимитера - не сигнал о перегрузке сайта
+        outcome = "throttled" if e.by_host else "skip"
+        raise
+    except Exception as e:
+        outcome = "challenge" if getattr(e, "timings", {}).get("captcha_clicks") else "error"
+        raise
+    finally:
+        _challenged.discard(key)
+        if acquired is not None:
+            _release(key, token, outcome, time.monotonic() - started)
+
+
+class ConcurrencyCollector:
+    """
+    Текущие лимиты всех хостов из Redis (одинаковые для всех процессов воркера)
+    """
+
+    def collect(self):
+        limits = GaugeMetricFamily("taxlien_host_concurrency_limit",
+                                   "Допустимое число одновременных загрузок хоста (AIMD)", labels=["host"])
+        inflight = GaugeMetricFamily("taxlien_host_concurrency_inflight",
+                                     "Занятые слоты загрузок хоста", labels=["host"])
+        try:
+            r = get_redis()
+            for state_key in r.scan_iter("concurrency:state:*"):
+                key = state_key[len("concurrency:state:"):]
+                limit = r.hget(state_key, "limit")
+                if limit is not None:
+                    limits.add_metric([key], float(limit))
+                inflight.add_metric([key], r.zcard(_keys(key)[1]))
+        except redis.RedisError:
+            pass
+        yield limits
+        yield inflight
+
+
+REGISTRY.register(ConcurrencyCollector())
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        print(f"Prometheus метрики на порту {METRICS_PORT}")
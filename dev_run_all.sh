@@ -3,6 +3,8 @@
 cd /home/alx-got-it/taxlien
 source venv/bin/activate
 
-nohup ./dev_run_celery.sh > celery.log 2>&1 &
+nohup ./dev_run_celery.sh browser > celery_browser.log 2>&1 &
+nohup ./dev_run_celery.sh parse > celery_parse.log 2>&1 &
+nohup ./dev_run_celery.sh io > celery_io.log 2>&1 &
 nohup ./dev_run_celery_beat.sh > celery_beat.log 2>&1 &
-nohup ./dev_run_flower.sh > flower.log 2>&1 &
\ No newline at end of file
+nohup ./dev_run_flower.sh > flower.log 2>&1 &
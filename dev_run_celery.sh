@@ -1,7 +1,33 @@
 #!/bin/bash
 
 # Start the Celery worker
-celery -A tasks worker --loglevel=debug
+# Роль воркера: browser | parse | io | all (по умолчанию - все очереди в одном воркере)
+ROLE=${1:-all}
+
+case "$ROLE" in
+  browser)
+    # Узкое место - Chrome в памяти: по процессу на браузер пула, без предвыборки
+    celery -A tasks worker -Q browser -n browser@%h --concurrency=${BROWSER_CONCURRENCY:-4} \
+      --prefetch-multiplier=1 -O fair --max-tasks-per-child=${BROWSER_MAX_TASKS_PER_CHILD:-500} --loglevel=debug
+    ;;
+  parse)
+    # Узкое место - CPU: процесс на ядро, браузеры не поднимаются
+    BROWSER_POOL_SIZE=0 celery -A tasks worker -Q parse -n parse@%h --concurrency=${PARSE_CONCURRENCY:-$(nproc)} \
+      --prefetch-multiplier=4 --loglevel=debug
+    ;;
+  io)
+    # Узкое место - диск/БД/брокер: потоки вместо процессов
+    BROWSER_POOL_SIZE=0 celery -A tasks worker -Q io -n io@%h --pool=threads --concurrency=${IO_CONCURRENCY:-16} \
+      --prefetch-multiplier=8 --loglevel=debug
+    ;;
+  all)
+    celery -A tasks worker -Q browser,parse,io --prefetch-multiplier=1 --loglevel=debug
+    ;;
+  *)
+    echo "Unknown role: $ROLE (browser | parse | io | all)"
+    exit 1
+    ;;
+esac
 
 # Start the Celery worker in the background
-#nohup celery -A tasks worker --loglevel=info &
\ No newline at end of file
+#nohup celery -A tasks worker --loglevel=info &
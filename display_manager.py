@@ -0,0 +1,182 @@
+"""
+Менеджер виртуальных дисплеев (Xvfb) на хосте
+
+Xvfb запускается один раз на хост для каждого номера дисплея из пула
+(DISPLAY_BASE .. DISPLAY_BASE + DISPLAY_POOL_SIZE - 1) и переживает процессы
+воркеров. Процессы арендуют слот на дисплее через flock, поэтому параллельные
+задачи не дерутся за один :99 и не платят за старт Xvfb на каждую страницу.
+Мертвые дисплеи перезапускаются при следующей аренде.
+"""
+
+import fcntl
+import os
+import subprocess
+import time
+from contextlib import contextmanager
+
+DISPLAY_BASE = int(os.environ.get("DISPLAY_BASE", 99))
+DISPLAY_POOL_SIZE = int(os.environ.get("DISPLAY_POOL_SIZE", 4))
+DISPLAY_SLOTS = int(os.environ.get("DISPLAY_SLOTS", 4))  # браузеров-процессов на один дисплей
+DISPLAY_SCREEN = os.environ.get("DISPLAY_SCREEN", "1920x1080x24")
+DISPLAY_LOCK_DIR = os.environ.get("DISPLAY_LOCK_DIR", "/tmp/taxlien-displays")
+DISPLAY_START_TIMEOUT = 10
+
+
+class VirtualDisplay:
+    """
+    Один Xvfb дисплей хоста
+    """
+
+    def __init__(self, number: int):
+        self.number = number
+        self.name = f":{number}"
+
+    @property
+    def socket_path(self) -> str:
+        return f"/tmp/.X11-unix/X{self.number}"
+
+    def _server_pid(self):
+        try:
+            with open(f"/tmp/.X{self.number}-lock", "r") as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def is_alive(self) -> bool:
+        pid = self._server_pid()
+        if pid is None or not os.path.exists(self.socket_path):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def start(self):
+        # Остатки от упавшего Xvfb мешают запуску на том же номере
+        for path in (f"/tmp/.X{self.number}-lock", self.socket_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        subprocess.Popen(
+            ["Xvfb", self.name, "-screen", "0", DISPLAY_SCREEN, "-ac", "-nolisten", "tcp"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+        deadline = time.monotonic() + DISPLAY_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.is_alive():
+                print(f"Xvfb запущен: {self.name}")
+                return
+            time.sleep(0.1)
+
+        raise RuntimeError(f"Не удалось запустить Xvfb {self.name}")
+
+    def ensure(self) -> bool:
+        """
+        Проверить дисплей и перезапустить, если он умер.
+        Возвращает True, если дисплей был жив
+        """
+        if self.is_alive():
+            return True
+
+        with _file_lock(f"display-{self.number}.start"):
+            if self.is_alive():
+                return True
+            print(f"Xvfb {self.name} не отвечает, перезапускаем")
+            self.start()
+        return False
+
+
+@contextmanager
+def _file_lock(name: str):
+    os.makedirs(DISPLAY_LOCK_DIR, exist_ok=True)
+    with open(os.path.join(DISPLAY_LOCK_DIR, f"{name}.lock"), "w") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class DisplayLease:
+    """
+    Аренда слота на дисплее. Слот держится flock'ом и освобождается
+    при release() или при смерти процесса
+    """
+
+    def __init__(self, display: VirtualDisplay, lock_file):
+        self.display = display
+        self._lock_file = lock_file
+
+    @property
+    def name(self) -> str:
+        return self.display.name
+
+    def ensure(self) -> bool:
+        return self.display.ensure()
+
+    def release(self):
+        if self._lock_file is None:
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+
+def acquire_display(timeout: int = 60) -> DisplayLease:
+    """
+    Арендовать свободный слот на одном из дисплеев хоста и выставить DISPLAY
+    для текущего процесса (pyautogui и Chrome берут дисплей из окружения)
+    """
+    os.makedirs(DISPLAY_LOCK_DIR, exist_ok=True)
+    deadline = time.monotonic() + timeout
+
+    while True:
+        for slot in range(DISPLAY_SLOTS):
+            for offset in range(DISPLAY_POOL_SIZE):
+                number = DISPLAY_BASE + offset
+                lock_file = open(os.path.join(DISPLAY_LOCK_DIR, f"display-{number}-slot-{slot}.lock"), "w")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock_file.close()
+                    continue
+
+                lease = DisplayLease(VirtualDisplay(number), lock_file)
+                try:
+                    lease.ensure()
+                except Exception:
+                    lease.release()
+                    raise
+                os.environ["DISPLAY"] = lease.name
+                return lease
+
+        if time.monotonic() > deadline:
+            raise TimeoutError("Нет свободных виртуальных дисплеев")
+        time.sleep(1)
+
+
+@contextmanager
+def display_session():
+    """
+    Дисплей на время блока with (для скриптов и разовых задач). Прежний DISPLAY
+    процесса восстанавливается: пул браузеров воркера остается на своем дисплее
+    """
+    previous = os.environ.get("DISPLAY")
+    lease = acquire_display()
+    try:
+        yield lease
+    finally:
+        lease.release()
+        if previous is None:
+            os.environ.pop("DISPLAY", None)
+        else:
+            os.environ["DISPLAY"] = previous
+
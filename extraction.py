@@ -0,0 +1,120 @@
+"""
+Структурное извлечение полей прямо в браузере
+
+Для платформ, где поля выбираются по шаблонам id (_lblParcelID,
+_lblLegalDescription, _grdValuation, ...), спецификация полей компилируется
+в JS функцию, которая выполняется в странице и возвращает компактный JSON
+вместо всего page source. Для страниц, полученных по HTTP, та же
+спецификация применяется через CSS селекторы BeautifulSoup.
+
+Поле спецификации:
+    selector - CSS селектор или список альтернатив (берется первый найденный)
+    index    - номер элемента среди найденных (по умолчанию 0)
+    then     - CSS селектор внутри найденного элемента
+    attr     - атрибут вместо текста
+"""
+
+import json
+
+from bs4 import BeautifulSoup
+
+INFO_TABLE = "[class*='tabular-data-two-column']"
+
+EXTRACTORS = {
+    "qpublic": {
+        "parcel_id": {"selector": f"{INFO_TABLE} [id*='_lblParcelID']"},
+        "owner": {"selector": "[id*='ctlBodyPane_ctl01_ctl00_lblName']"},
+        "site_address": {"selector": "[id*='InfoPane2_lnkWebsite']", "attr": "href"},
+        "legal_description": {"selector": f"{INFO_TABLE} [id*='_lblLegalDescription']"},
+        "property_tax_account": {"selector": f"{INFO_TABLE} [id*='_lblPropertyID']"},
+        "total_due_amount": {"selector": "[id*='_grdValuation'] [class*='double-total-line']", "index": 2,
+                             "then": "[class*='value-column']"},
+        "last_year_due_amount": {"selector": "[id*='_grdValuation'] [class*='double-total-line']", "index": 1,
+                                 "then": "[class*='value-column']"},
+    },
+    "beacon": {
+        "parcel_id": {"selector": f"{INFO_TABLE} [id*='_lblParcelID']"},
+        "owner": {"selector": "[id*='ctlBodyPane_ctl01_ctl00_lblName']"},
+        "site_address": {"selector": "[id*='InfoPane2_lnkWebsite']", "attr": "href"},
+        "legal_description": {"selector": f"{INFO_TABLE} [id*='_lblLegalDescription']"},
+        "property_tax_account": {"selector": f"{INFO_TABLE} [id*='_lblPropertyID']"},
+        "mailing_address": {"selector": f"{INFO_TABLE} [id*='_lblMailingAddress']"},
+        "property_type": {"selector": [f"{INFO_TABLE} [id*='_lblPropertyType']", f"{INFO_TABLE} [id*='_lblUseCode']"]},
+        "building_sqft": {"selector": [f"{INFO_TABLE} [id*='_lblSquareFeet']", f"{INFO_TABLE} [id*='_lblLivingArea']"]},
+        "year_built": {"selector": f"{INFO_TABLE} [id*='_lblYearBuilt']"},
+        "bedrooms": {"selector": f"{INFO_TABLE} [id*='_lblBedrooms']"},
+        "bathrooms": {"selector": f"{INFO_TABLE} [id*='_lblBathrooms']"},
+        "lot_size": {"selector": [f"{INFO_TABLE} [id*='_lblLotSize']", f"{INFO_TABLE} [id*='_lblAcres']"]},
+        "zoning": {"selector": f"{INFO_TABLE} [id*='_lblZoning']"},
+        "total_due_amount": {"selector": "[id*='_grdValuation'] [class*='double-total-line'], "
+                                         "[id*='_grdTax'] [class*='total-row']", "index": 2,
+                             "then": "[class*='value-column']"},
+        "last_year_due_amount": {"selector": "[id*='_grdValuation'] [class*='double-total-line'], "
+                                             "[id*='_grdTax'] [class*='total-row']", "index": 1,
+                                 "then": "[class*='value-column']"},
+    },
+}
+
+EXTRACTOR_JS_TEMPLATE = """
+const spec = %s;
+const record = {};
+for (const [field, rule] of Object.entries(spec)) {
+    const selectors = Array.isArray(rule.selector) ? rule.selector : [rule.selector];
+    let el = null;
+    for (const selector of selectors) {
+        el = document.querySelectorAll(selector)[rule.index || 0] || null;
+        if (el) break;
+    }
+    if (el && rule.then) el = el.querySelector(rule.then);
+    if (!el) { record[field] = null; continue; }
+    const value = rule.attr ? el.getAttribute(rule.attr) : el.textContent;
+    record[field] = value === null ? null : value.trim();
+}
+return record;
+"""
+
+_compiled = {}
+
+
+def has_extractor(platform: str) -> bool:
+    return platform in EXTRACTORS
+
+
+def compile_extractor(platform: str) -> str:
+    if platform not in _compiled:
+        _compiled[platform] = EXTRACTOR_JS_TEMPLATE % json.dumps(EXTRACTORS[platform])
+    return _compiled[platform]
+
+
+def extract_record(sb, platform: str) -> dict:
+    """
+    Извлечь запись в странице браузера одним вызовом JS
+    """
+    return sb.execute_script(compile_extractor(platform))
+
+
+def extract_from_html(html: str, platform: str) -> dict:
+    """
+    То же извлечение для HTML, полученного без браузера
+    """
+    doc = BeautifulSoup(html, "html.parser")
+    record = {}
+
+    for field, rule in EXTRACTORS[platform].items():
+        selectors = rule["selector"] if isinstance(rule["selector"], list) else [rule["selector"]]
+        el = None
+        for selector in selectors:
+            found = doc.select(selector)
+            index = rule.get("index", 0)
+            if len(found) > index:
+                el = found[index]
+                break
+        if el is not None and rule.get("then"):
+            el = el.select_one(rule["then"])
+        if el is None:
+            record[field] = None
+            continue
+        value = el.get(rule["attr"]) if rule.get("attr") else el.get_text()
+        record[field] = value.strip() if value is not None else None
+
+    return record
@@ -0,0 +1,223 @@
+"""
+Гибридный fetch: сначала HTTP, браузер только когда он действительно нужен
+
+Ответ HTTP проверяется предикатом платформы ("это настоящая страница, а не
+challenge/заглушка"). Если проверка не прошла - страница берется браузером,
+а для хоста запоминается режим "browser", чтобы следующие запросы сразу шли
+в браузер. Хосты с Cloudflare (clearance.py) пробуются по HTTP, пока для них
+есть действующий clearance.
+"""
+
+import os
+import re
+import threading
+import time
+
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+
+from canonical import detect_platform
+from celery_app import get_redis
+from clearance import get_host, uses_clearance, store as clearance_store, fetch_with_clearance, \
+    is_challenge_response
+from extraction import extract_from_html
+from outcomes import NotFoundError
+from rate_limiter import acquire, check_throttled
+
+HOST_MODE_TTL = int(os.environ.get("HOST_MODE_TTL", 7 * 24 * 3600))  # через неделю хост перепроверяется
+HTTP_TIMEOUT = 30
+
+MODE_HTTP = "http"
+MODE_BROWSER = "browser"
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+JS_REQUIRED_MARKERS = [
+    "enable javascript",
+    "javascript is required",
+    "requires javascript",
+]
+
+
+#  -----------------------------------------------------------------------------------------
+#   Предикаты "настоящей" страницы
+#  -----------------------------------------------------------------------------------------
+
+def is_generic_page(html: str) -> bool:
+    if not html or len(html) < 500:
+        return False
+    head = html[:5000].lower()
+    if "<title>just a moment" in head:
+        return False
+    if len(html) < 5000 and any(marker in html.lower() for marker in JS_REQUIRED_MARKERS):
+        return False
+    return True
+
+
+def is_schneider_page(html: str) -> bool:
+    return is_generic_page(html) and "ctlBodyPane" in html
+
+
+def is_bid4assets_page(html: str) -> bool:
+    # Карточка лота без JS рендеринга не содержит блоков ставок
+    return is_generic_page(html) and re.search(r"(current|high|opening|starting)-bid", html) is not None
+
+
+PAGE_PREDICATES = {
+    "qpublic": is_schneider_page,
+    "beacon": is_schneider_page,
+    "bid4assets": is_bid4assets_page,
+}
+
+
+def is_real_page(html: str, platform: str = None) -> bool:
+    return PAGE_PREDICATES.get(platform, is_generic_page)(html)
+
+
+#  -----------------------------------------------------------------------------------------
+#   Запомненный режим хоста
+#  -----------------------------------------------------------------------------------------
+
+# Локальная копия режимов процесса; Redis - общий источник для всех воркеров
+_host_modes = {}
+
+
+def get_host_mode(host: str):
+    if host in _host_modes:
+        return _host_modes[host]
+    try:
+        mode = get_redis().get(f"fetch_mode:{host}")
+    except redis.RedisError:
+        mode = None
+    if mode:
+        _host_modes[host] = mode
+    return mode
+
+
+def set_host_mode(host: str, mode: str):
+    if _host_modes.get(host) == mode:
+        return
+    _host_modes[host] = mode
+    print(f"Режим fetch для {host}: {mode}")
+    try:
+        get_redis().set(f"fetch_mode:{host}", mode, ex=HOST_MODE_TTL)
+    except redis.RedisError:
+        pass
+
+
+#  -----------------------------------------------------------------------------------------
+#   HTTP
+#  -----------------------------------------------------------------------------------------
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(host: str) -> requests.Session:
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _sessions[host] = session
+        return session
+
+
+def http_fetch(url: str, acquired: bool = False):
+    """
+    Забрать страницу без браузера.
+    Возвращает (html, status), status: ok | rejected | not_found | error.
+    Токен запроса берется у rate_limiter (acquired - уже взят вызывающим); 429 от сайта - RateLimited
+    """
+    if not acquired:
+        acquire(url)
+
+    if uses_clearance(url):
+        html = fetch_with_clearance(url)
+        return (html, "ok") if html is not None else (None, "rejected")
+
+    try:
+        response = _get_session(get_host(url)).get(url, timeout=HTTP_TIMEOUT, allow_redirects=True)
+    except requests.RequestException as e:
+        print(f"HTTP ошибка {url}: {e}")
+        return None, "error"
+
+    if is_challenge_response(response) or response.status_code in (401, 403):
+        return None, "rejected"
+    check_throttled(url, response)
+    if response.status_code in (404, 410):
+        return None, "not_found"
+    if response.status_code != 200:
+        return None, "error"
+    return response.text, "ok"
+
+
+#  -----------------------------------------------------------------------------------------
+#   Fetch
+#  -----------------------------------------------------------------------------------------
+
+def try_http(url: str, platform: str = None, acquired: bool = False):
+    """
+    Только HTTP попытка с учетом запомненного режима хоста (без браузера). None - нужен браузер,
+    NotFoundError - страницы нет
+    """
+    platform = platform or detect_platform(url)
+    host = get_host(url)
+    mode = get_host_mode(host)
+
+    # Для Cloudflare хостов HTTP возможен, пока есть clearance
+    try_http = mode != MODE_BROWSER or (uses_clearance(url) and clearance_store.get(host) is not None)
+    if not try_http:
+        return None
+
+    started = time.monotonic()
+    html, status = http_fetch(url, acquired=acquired)
+    if status == "not_found":
+        raise NotFoundError("Страница не найдена (404/410)", url)
+    if status == "ok" and is_real_page(html, platform):
+        set_host_mode(host, MODE_HTTP)
+        print(f"HTTP {url} ({time.monotonic() - started:.1f} сек)")
+        return html
+    if status != "error":
+        set_host_mode(host, MODE_BROWSER)
+    return None
+
+
+def fetch(url: str, platform: str = None, headless: bool = False, block_images: bool = False) -> str:
+    """
+    Получить HTML страницы: HTTP, если хост это позволяет, иначе браузер.
+    Один токен лимитера на загрузку, в том числе при переходе с HTTP на браузер
+    """
+    platform = platform or detect_platform(url)
+    acquire(url)
+    html = try_http(url, platform, acquired=True)
+    if html is not None:
+        return html
+
+    # functions тянет seleniumbase; samples используют только HTTP часть движка
+    from functions import scrape_single_url
+    return scrape_single_url(url, headless=headless, block_images=block_images, platform=platform, acquired=True)
+
+
+def fetch_record(url: str, platform: str = None, keep_html: bool = False):
+    """
+    Получить структурированную запись страницы (extraction.EXTRACTORS) вместо HTML.
+    Возвращает (record, html), html только при keep_html
+    """
+    platform = platform or detect_platform(url)
+    acquire(url)
+    html = try_http(url, platform, acquired=True)
+    if html is not None:
+        return extract_from_html(html, platform), (html if keep_html else None)
+
+    from functions import scrape_single_record
+    return scrape_single_record(url, platform, keep_html=keep_html, acquired=True)
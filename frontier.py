@@ -0,0 +1,216 @@
+"""
+Постоянная очередь URL обхода (frontier) в Redis
+
+Каждый URL хранится под стабильным ID parcel (canonical.parcel_id) с состоянием
+pending / leased / done / failed, числом попыток и временем добавления/изменения.
+Повторное добавление уже известного ключа ничего не делает (exactly-once enqueue),
+воркеры берут записи пачками в аренду (lease) на FRONTIER_LEASE_TTL - аренда
+умершего воркера истекает и запись возвращается в pending. Поэтому обход
+округа, прерванный перезапуском, продолжается с того же места, а готовые
+parcels повторно не загружаются.
+
+Ключи Redis для frontier <name> (например "qpublic", "tyler:<county>"):
+    frontier:<name>:e:<key>   - hash записи (url, state, attempts, added_at, updated_at, error, meta)
+    frontier:<name>:pending   - zset ключей, score - когда запись можно брать
+    frontier:<name>:leased    - zset ключей, score - когда истекает аренда
+    frontier:<name>:stats     - hash счетчиков по состояниям
+    frontier:<name>:host:<h>  - zset ключей в работе по хосту (rate_key), score - истечение аренды
+    frontier:names            - set всех frontier (для диспетчера)
+"""
+
+import json
+import os
+
+from celery_app import get_redis
+from canonical import parcel_id
+from redis_scripts import script, NOW_LUA
+
+FRONTIER_LEASE_TTL = int(os.environ.get("FRONTIER_LEASE_TTL", 1800))
+FRONTIER_MAX_ATTEMPTS = int(os.environ.get("FRONTIER_MAX_ATTEMPTS", 3))
+FRONTIER_RETRY_DELAY = int(os.environ.get("FRONTIER_RETRY_DELAY", 300))
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# KEYS[1] - префикс frontier; ARGV - тройки key, url, meta. Возвращает число новых записей
+ENQUEUE_LUA = NOW_LUA + """
+local prefix = KEYS[1]
+local added = 0
+for i = 1, #ARGV, 3 do
+    local entry = prefix .. ':e:' .. ARGV[i]
+    if redis.call('EXISTS', entry) == 0 then
+        redis.call('HSET', entry, 'url', ARGV[i + 1], 'meta', ARGV[i + 2], 'state', 'pending',
+                   'attempts', 0, 'added_at', now, 'updated_at', now)
+        redis.call('ZADD', prefix .. ':pending', now, ARGV[i])
+        added = added + 1
+    end
+end
+if added > 0 then redis.call('HINCRBY', prefix .. ':stats', 'pending', added) end
+return added
+"""
+
+# KEYS[1] - префикс; ARGV: count, lease_ttl, max_attempts. Возвращает [key, url, meta, ...]
+LEASE_LUA = NOW_LUA + """
+local prefix = KEYS[1]
+local stats = prefix .. ':stats'
+
+-- Истекшие аренды возвращаются в pending (или failed, если попытки кончились)
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', prefix .. ':leased', '-inf', now)) do
+    local entry = prefix .. ':e:' .. key
+    redis.call('ZREM', prefix .. ':leased', key)
+    redis.call('HINCRBY', stats, 'leased', -1)
+    if tonumber(redis.call('HGET', entry, 'attempts')) >= tonumber(ARGV[3]) then
+        redis.call('HSET', entry, 'state', 'failed', 'error', 'lease expired', 'updated_at', now)
+        redis.call('HINCRBY', stats, 'failed', 1)
+    else
+        redis.call('HSET', entry, 'state', 'pending', 'updated_at', now)
+        redis.call('ZADD', prefix .. ':pending', now, key)
+        redis.call('HINCRBY', stats, 'pending', 1)
+    end
+end
+
+local result = {}
+local keys = redis.call('ZRANGEBYSCORE', prefix .. ':pending', '-inf', now, 'LIMIT', 0, tonumber(ARGV[1]))
+for _, key in ipairs(keys) do
+    local entry = prefix .. ':e:' .. key
+    redis.call('ZREM', prefix .. ':pending', key)
+    redis.call('ZADD', prefix .. ':leased', now + tonumber(ARGV[2]), key)
+    redis.call('HSET', entry, 'state', 'leased', 'updated_at', now)
+    redis.call('HINCRBY', entry, 'attempts', 1)
+    local fields = redis.call('HMGET', entry, 'url', 'meta')
+    table.insert(result, key)
+    table.insert(result, fields[1])
+    table.insert(result, fields[2])
+end
+if #keys > 0 then
+    redis.call('HINCRBY', stats, 'pending', -#keys)
+    redis.call('HINCRBY', stats, 'leased', #keys)
+end
+return result
+"""
+
+# KEYS[1] - префикс; ARGV: key, state (done | failed | pending), error, retry_delay, refund (1 - вернуть попытку)
+FINISH_LUA = NOW_LUA + """
+local prefix = KEYS[1]
+local key = ARGV[1]
+local entry = prefix .. ':e:' .. key
+local old = redis.call('HGET', entry, 'state')
+if not old or old == 'done' then return 0 end
+
+local state = ARGV[2]
+redis.call('ZREM', prefix .. ':leased', key)
+redis.call('ZREM', prefix .. ':pending', key)
+redis.call('HSET', entry, 'state', state, 'error', ARGV[3], 'updated_at', now)
+local host = redis.call('HGET', entry, 'host')
+if host then redis.call('ZREM', prefix .. ':host:' .. host, key) end
+if ARGV[5] == '1' then redis.call('HINCRBY', entry, 'attempts', -1) end
+if state == 'pending' then
+    redis.call('ZADD', prefix .. ':pending', now + tonumber(ARGV[4]), key)
+end
+redis.call('HINCRBY', prefix .. ':stats', old, -1)
+redis.call('HINCRBY', prefix .. ':stats', state, 1)
+return 1
+"""
+
+# KEYS[1] - префикс; ARGV: key, host, lease_ttl. Запись отдана в обработку - учесть в нагрузке хоста
+TRACK_LUA = NOW_LUA + """
+redis.call('HSET', KEYS[1] .. ':e:' .. ARGV[1], 'host', ARGV[2])
+redis.call('ZADD', KEYS[1] .. ':host:' .. ARGV[2], now + tonumber(ARGV[3]), ARGV[1])
+"""
+
+# KEYS[1] - zset хоста. Число записей в работе (с неистекшей арендой)
+HOST_LOAD_LUA = NOW_LUA + """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+
+def entry_key(url: str, platform: str = None) -> str:
+    return parcel_id(url, platform)
+
+
+class Frontier:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.platform = name.split(":")[0]
+        self.prefix = f"frontier:{name}"
+
+    def enqueue(self, urls: list, meta: dict = None) -> int:
+        """
+        Добавить URL; уже известные (по ID parcel) пропускаются.
+        Возвращает число новых записей
+        """
+        meta_json = json.dumps(meta or {})
+        args = []
+        seen = set()
+        for url in urls:
+            if not url:
+                continue
+            key = entry_key(url, self.platform)
+            if key in seen:
+                continue
+            seen.add(key)
+            args.extend([key, url, meta_json])
+        if not args:
+            return 0
+
+        r = get_redis()
+        r.sadd("frontier:names", self.name)
+        added = 0
+        # Пачками, чтобы один Lua вызов не блокировал Redis надолго
+        for start in range(0, len(args), 3 * 500):
+            added += script(ENQUEUE_LUA)(keys=[self.prefix], args=args[start:start + 3 * 500])
+        return added
+
+    def lease(self, count: int, ttl: int = FRONTIER_LEASE_TTL) -> list:
+        """
+        Взять в аренду до count записей: [(key, url, meta), ...]
+        """
+        flat = script(LEASE_LUA)(keys=[self.prefix], args=[count, ttl, FRONTIER_MAX_ATTEMPTS])
+        return [(flat[i], flat[i + 1], json.loads(flat[i + 2] or "{}")) for i in range(0, len(flat), 3)]
+
+    def _finish(self, key: str, state: str, error: str = "", retry_delay: float = 0, refund: bool = False) -> bool:
+        return bool(script(FINISH_LUA)(keys=[self.prefix],
+                                       args=[key, state, error, retry_delay, int(refund)]))
+
+    def done(self, key: str) -> bool:
+        return self._finish(key, DONE)
+
+    def fail(self, key: str, error: str = "", retry_delay: int = FRONTIER_RETRY_DELAY, final: bool = False) -> bool:
+        """
+        Неудача: запись вернется в pending через retry_delay, пока не кончатся попытки.
+        final - сразу failed (например, страницы нет)
+        """
+        attempts = int(get_redis().hget(f"{self.prefix}:e:{key}", "attempts") or 0)
+        if final or attempts >= FRONTIER_MAX_ATTEMPTS:
+            return self._finish(key, FAILED, error)
+        return self._finish(key, PENDING, error, retry_delay)
+
+    def park(self, key: str, delay: float, reason: str = "parked") -> bool:
+        """
+        Отложить арендованную запись на delay сек без траты попытки (хост недоступен)
+        """
+        return self._finish(key, PENDING, reason, delay, refund=True)
+
+    def track(self, key: str, host: str, ttl: int = FRONTIER_LEASE_TTL):
+        """
+        Запись отдана в обработку: она считается нагрузкой хоста, пока не завершится или не истечет аренда
+        """
+        script(TRACK_LUA)(keys=[self.prefix], args=[key, host, ttl])
+
+    def host_load(self, host: str) -> int:
+        return script(HOST_LOAD_LUA)(keys=[f"{self.prefix}:host:{host}"])
+
+    def get(self, key: str) -> dict:
+        return get_redis().hgetall(f"{self.prefix}:e:{key}")
+
+    def stats(self) -> dict:
+        counts = get_redis().hgetall(f"{self.prefix}:stats")
+        return {state: int(counts.get(state, 0)) for state in (PENDING, LEASED, DONE, FAILED)}
+
+
+def all_frontiers() -> list:
+    return sorted(get_redis().smembers("frontier:names"))
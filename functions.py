@@ -1,12 +1,17 @@
 import csv
+import fcntl
 import json
 import os
-from datetime import datetime
 
-from sbvirtualdisplay import Display
 from seleniumbase import SB
 
-os.environ['DISPLAY'] = ':99'
+from browser_pool import browser_session
+from clearance import uses_clearance, export_clearance
+from concurrency import note_challenge
+from extraction import extract_record
+from interception import choose_profile, apply_interception, record_page_metrics
+from rate_limiter import acquire
+from readiness import wait_until_ready
 
 
 def get_platforms_urls():
@@ -36,10 +41,20 @@ def save_csv(data: dict, platform: str, name: str) -> None:
         writer.writerow(data.values())  # записать данные
 
 
-def import_to_db(data: dict) -> None:
+def import_to_db(data: dict, platform: str = "qpublic", record_id: str = None) -> None:
     # TODO: формируем из словаря data объект и импортируем его в базу
-    # TODO: реализовать непосредственный импорт в базу через ORM
-    save_csv(data, "qpublic", "qpublic")
+    # TODO: реализовать непосредственный импорт в базу через ORM (upsert по id)
+    # Пока upsert в файл на запись: повторный обход перезаписывает ту же запись, а не дописывает дубль
+    if record_id:
+        data = {"id": record_id, **data}
+        os.makedirs(f'./storage/{platform}/records', exist_ok=True)
+        file_path = f'./storage/{platform}/records/{record_id}.json'
+        tmp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(data))
+        os.replace(tmp_path, file_path)
+    else:
+        save_csv(data, platform, platform)
     print("Данные импортированы в базу")
 
 
@@ -53,48 +68,108 @@ def save_json(data: dict, platform: str, name: str) -> None:
         file.write(json.dumps(data))
 
 
-def scrape_single_url(url: str, headless: bool = False, block_images: bool = False):
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print(f'Display is alive: {disp.is_alive()}')
-
-        with SB(uc=True, headless=headless, block_images=block_images) as sb:
-            sb.uc_open_with_reconnect(url, 2)
-            scraper_pass_challenge(sb)
-            scraper_pass_modal(sb)
-
-            html = r"{}".format(sb.get_page_source())
-            return html
-
+def append_jsonl(records: list, platform: str, name: str) -> int:
+    """
+    Дописать записи в JSONL файл (по строке на запись); блокировка - для параллельных воркеров
+    """
+    if not records:
+        return 0
+    lines = "".join(json.dumps(record) + "\n" for record in records)
+    with open(f'./storage/{platform}/{name}.jsonl', 'a', encoding='utf-8') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            file.write(lines)
+            file.flush()
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+    return len(records)
+
+
+def open_page(sb: SB, url: str, platform: str = None, acquired: bool = False) -> None:
+    """
+    Открыть страницу в браузере. acquired - токен лимитера уже взят вызывающим (fetch_engine)
+    """
+    interception_profile = choose_profile(platform)
+    apply_interception(sb, interception_profile)
+    if not acquired:
+        acquire(url)
+    sb.uc_open_with_reconnect(url, 2)
+    apply_interception(sb, interception_profile)
+    timings = scraper_pass_challenge(sb, platform)
+    if timings["captcha_clicks"]:
+        note_challenge(url)
+    scraper_pass_modal(sb, platform)
+    record_page_metrics(sb, platform, interception_profile)
+
+    if uses_clearance(url):
+        export_clearance(sb, url)
+
+
+def scrape_single_url(url: str, headless: bool = False, block_images: bool = False, platform: str = None,
+                      acquired: bool = False):
+    with browser_session(headless=headless, block_images=block_images) as sb:
+        open_page(sb, url, platform, acquired=acquired)
+
+        html = r"{}".format(sb.get_page_source())
+        return html
+
+
+def scrape_single_record(url: str, platform: str, keep_html: bool = False, acquired: bool = False):
+    """
+    Открыть страницу и извлечь запись прямо в браузере.
+    Возвращает (record, html), html только при keep_html
+    """
+    with browser_session() as sb:
+        open_page(sb, url, platform, acquired=acquired)
+
+        record = extract_record(sb, platform)
+        html = sb.get_page_source() if keep_html else None
+        return record, html
+
+
+def scraper_pass_challenge(sb: SB, platform: str = None) -> dict:
+    # Ограниченное по времени ожидание готовности страницы (см. readiness.READINESS)
+    timings = wait_until_ready(sb, platform)
+    print(f"Opening page: {sb.get_page_title()} {timings}")
+    return timings
+
+
+# Кнопки закрытия модальных окон (согласие с условиями и т.п.) по платформам
+MODAL_SELECTORS = {
+    "qpublic": ["[class*='btn btn-primary button-1']"],
+    "beacon": ["[class*='btn btn-primary button-1']"],
+}
+DEFAULT_MODAL_SELECTORS = ["[class*='btn btn-primary button-1']"]
+MODAL_MAX_ROUNDS = 3
+
+# Одним вызовом находит видимые кнопки закрытия и кликает их, возвращает число кликов
+DISMISS_MODALS_JS = """
+let clicked = 0;
+for (const selector of arguments[0]) {
+    for (const el of document.querySelectorAll(selector)) {
+        if (el.getClientRects().length === 0) continue;
+        el.click();
+        clicked++;
+    }
+}
+return clicked;
+"""
 
-def make_sites_visited_history(sb: SB):
-    sb.uc_open_with_reconnect("https://instagram.com/", 2)
-    sb.uc_open_with_reconnect("https://google.com/", 2)
-    sb.uc_open_with_reconnect("https://www.x.com/", 2)
-    sb.sleep(2)
 
+def scraper_pass_modal(sb: SB, platform: str = None) -> int:
+    selectors = MODAL_SELECTORS.get(platform, DEFAULT_MODAL_SELECTORS)
+    dismissed = 0
 
-def scraper_pass_challenge(sb: SB):
-    while True:
-        sb.uc_gui_click_captcha()
-        sb.sleep(1)
-        title = str(sb.get_page_title()).lower()
-        if "just a moment..." in title:
-            print(f"Passing cloudflare challenge")
-            continue
-        if "qpublic" in title:
-            print(f"Opening page: {title}")
+    # Закрытие одного окна может открыть следующее, поэтому несколько раундов
+    for _ in range(MODAL_MAX_ROUNDS):
+        clicked = sb.execute_script(DISMISS_MODALS_JS, selectors) or 0
+        if not clicked:
             break
+        dismissed += clicked
 
-
-def scraper_pass_modal(sb: SB):
-    while True:
-        try:
-            sb.click(selector="[class*='btn btn-primary button-1']", by="css selector", timeout=3)
-        except:
-            break
+    return dismissed
 
 
 def generate_name(platform: str, uid: str) -> str:
-    now = datetime.now()
-    current_date = now.strftime("%d-%m-%Y")
-    return f"{platform}_{current_date}_{uid}"
+    # Без даты: повторный обход пишет в те же файлы (uid - стабильный ID, см. canonical.parcel_id)
+    return f"{platform}_{uid}"
@@ -0,0 +1,98 @@
+"""
+Массовое чтение списков со страницы
+
+Вместо find_elements + get_attribute на каждый элемент (один запрос к
+WebDriver на каждую ссылку - тысячи для большого округа) все значения
+собираются одним execute_script. harvest_html делает то же по уже
+полученному page source без браузера.
+
+fields: "text", "href" (абсолютный URL, как get_attribute("href")) или имя атрибута.
+"""
+
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+HARVEST_JS = """
+const selectors = arguments[0];
+const fields = arguments[1];
+for (const selector of selectors) {
+    const elements = document.querySelectorAll(selector);
+    if (!elements.length) continue;
+    return Array.from(elements).map(el => {
+        const item = {};
+        for (const field of fields) {
+            if (field === 'text') item.text = (el.innerText || el.textContent || '').trim();
+            else if (field === 'href') item.href = el.href || el.getAttribute('href');
+            else item[field] = el.getAttribute(field);
+        }
+        return item;
+    });
+}
+return [];
+"""
+
+
+def _selectors(selector) -> list:
+    return selector if isinstance(selector, (list, tuple)) else [selector]
+
+
+def harvest(sb, selector, fields=("href",)) -> list:
+    """
+    Значения полей всех элементов по селектору одним вызовом JS.
+    selector может быть списком альтернатив - берется первый, нашедший элементы
+    """
+    return sb.execute_script(HARVEST_JS, _selectors(selector), list(fields)) or []
+
+
+def harvest_attr(sb, selector, attr: str = "href") -> list:
+    """
+    Непустые значения одного поля (по умолчанию href)
+    """
+    return [item[attr] for item in harvest(sb, selector, (attr,)) if item.get(attr)]
+
+
+def harvest_html(html: str, selector, fields=("href",), base_url: str = None) -> list:
+    """
+    То же по HTML снимку страницы, без браузера
+    """
+    doc = BeautifulSoup(html, "html.parser")
+    for css in _selectors(selector):
+        elements = doc.select(css)
+        if not elements:
+            continue
+        items = []
+        for el in elements:
+            item = {}
+            for field in fields:
+                if field == "text":
+                    item["text"] = el.get_text(strip=True)
+                elif field == "href":
+                    href = el.get("href")
+                    item["href"] = urljoin(base_url, href) if href and base_url else href
+                else:
+                    item[field] = el.get(field)
+            items.append(item)
+        return items
+    return []
+
+
+HARVEST_OPTIONS_JS = """
+return Array.from(document.querySelectorAll(arguments[0])).map((el, index) => {
+    const link = el.matches('a[href]') ? el : el.querySelector('a[href]');
+    return {
+        index: index,
+        id: el.id,
+        text: (el.innerText || el.textContent || '').trim(),
+        href: link ? link.href : (el.dataset.url || el.dataset.href || null),
+    };
+});
+"""
+
+
+def harvest_options(sb, selector: str) -> list:
+    """
+    Пункты выпадающего списка одним вызовом: index, id, text и ссылка, если она есть
+    в самом пункте (тогда пункт не нужно выбирать кликом, чтобы узнать URL)
+    """
+    return sb.execute_script(HARVEST_OPTIONS_JS, selector) or []
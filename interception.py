@@ -0,0 +1,136 @@
+"""
+Профили перехвата сетевых запросов браузера (CDP)
+
+Для каждой платформы задается профиль: какие ресурсы блокировать по шаблону URL
+и по типу ресурса. Парсерам не нужны шрифты, аналитика, тайлы карт и реклама,
+поэтому страница грузится быстрее и с меньшим трафиком.
+
+Блокировка делается через Network.setBlockedURLs: в UC режиме у chromedriver
+нет цикла событий для Fetch.requestPaused, поэтому тип ресурса задается
+шаблонами расширений (RESOURCE_TYPE_PATTERNS). uc_open_with_reconnect
+переподключает драйвер, поэтому профиль применяется и до, и после открытия.
+
+Сэкономленные байты и время считаются относительно базовых страниц: каждая
+INTERCEPTION_BASELINE_EVERY-я страница грузится без блокировки.
+"""
+
+import os
+import random
+
+import redis
+
+from celery_app import get_redis
+
+INTERCEPTION_BASELINE_EVERY = int(os.environ.get("INTERCEPTION_BASELINE_EVERY", 50))
+
+RESOURCE_TYPE_PATTERNS = {
+    "font": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"],
+    "image": ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico"],
+    "media": ["*.mp4", "*.webm", "*.mp3", "*.m3u8"],
+}
+
+TRACKING_PATTERNS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*facebook.net*",
+    "*hotjar.com*",
+    "*newrelic.com*",
+    "*nr-data.net*",
+]
+
+MAP_TILE_PATTERNS = [
+    "*/MapServer/tile/*",
+    "*/tile/*/*/*",
+    "*arcgisonline.com*",
+    "*tiles.virtualearth.net*",
+]
+
+INTERCEPTION_PROFILES = {
+    "none": {"resource_types": [], "urls": []},
+    "schneider": {"resource_types": ["font", "media"], "urls": TRACKING_PATTERNS + MAP_TILE_PATTERNS},
+    "default": {"resource_types": ["font", "media"], "urls": TRACKING_PATTERNS},
+}
+
+PLATFORM_PROFILES = {
+    "qpublic": "schneider",
+    "beacon": "schneider",
+}
+
+# Размер страницы и тайминги из Navigation/Resource Timing API
+PAGE_METRICS_JS = """
+const nav = performance.getEntriesByType('navigation')[0];
+const resources = performance.getEntriesByType('resource');
+let bytes = nav ? nav.transferSize : 0;
+for (const r of resources) bytes += r.transferSize || 0;
+return {
+    bytes: bytes,
+    requests: resources.length + 1,
+    dcl_ms: nav ? nav.domContentLoadedEventEnd : null,
+};
+"""
+
+
+def blocked_patterns(profile_name: str) -> list:
+    profile = INTERCEPTION_PROFILES[profile_name]
+    patterns = list(profile["urls"])
+    for resource_type in profile["resource_types"]:
+        patterns.extend(RESOURCE_TYPE_PATTERNS[resource_type])
+    return patterns
+
+
+def choose_profile(platform: str = None) -> str:
+    if INTERCEPTION_BASELINE_EVERY > 0 and random.randrange(INTERCEPTION_BASELINE_EVERY) == 0:
+        return "none"
+    return PLATFORM_PROFILES.get(platform, "default")
+
+
+def apply_interception(sb, profile_name: str):
+    try:
+        sb.driver.execute_cdp_cmd("Network.enable", {})
+        sb.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_patterns(profile_name)})
+    except Exception as e:
+        print(f"Не удалось применить профиль перехвата {profile_name}: {e}")
+
+
+def clear_interception(sb):
+    try:
+        sb.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+    except Exception:
+        pass
+
+
+def record_page_metrics(sb, platform: str, profile_name: str) -> dict:
+    """
+    Записать размер и время загрузки страницы и посчитать экономию относительно базовых страниц
+    """
+    try:
+        metrics = sb.execute_script(PAGE_METRICS_JS)
+    except Exception:
+        return {}
+    if not metrics or metrics.get("dcl_ms") is None:
+        return {}
+
+    platform = platform or "unknown"
+    try:
+        r = get_redis()
+        key = f"interception:{platform}:{profile_name}"
+        pipe = r.pipeline()
+        pipe.hincrby(key, "pages", 1)
+        pipe.hincrbyfloat(key, "bytes", metrics["bytes"])
+        pipe.hincrbyfloat(key, "dcl_ms", metrics["dcl_ms"])
+        pipe.hgetall(f"interception:{platform}:none")
+        baseline = pipe.execute()[-1]
+
+        if profile_name != "none" and int(baseline.get("pages", 0)) > 0:
+            pages = int(baseline["pages"])
+            metrics["saved_bytes"] = float(baseline["bytes"]) / pages - metrics["bytes"]
+            metrics["saved_ms"] = float(baseline["dcl_ms"]) / pages - metrics["dcl_ms"]
+            r.hincrbyfloat(key, "saved_bytes", metrics["saved_bytes"])
+            r.hincrbyfloat(key, "saved_ms", metrics["saved_ms"])
+    except redis.RedisError:
+        pass
+
+    print(f"Страница ({platform}, профиль {profile_name}): {metrics}")
+    return metrics
@@ -0,0 +1,188 @@
+"""
+Типизированные исходы загрузки страницы и dead-letter очередь
+
+Задача загрузки/разбора либо возвращает результат (success), либо поднимает
+одно из исключений ниже - строка с текстом ошибки дальше по цепочке не идет:
+    TransientFetchError - сеть, таймаут, браузер: повтор с экспоненциальной
+                          задержкой и jitter (autoretry FetchTask)
+    BlockedError        - сайт отказал (403, challenge не пройден)
+    NotFoundError       - страницы нет (404/410), повторять бессмысленно
+    ParseFailedError    - страница получена, но поля не разобраны
+
+Исключение останавливает цепочку: save/parse/import для неудачной страницы не
+запускаются. Окончательные неудачи (кроме not-found) кладутся в Redis список
+DEAD_LETTER_KEY вместе с остатком цепочки и повторяются replay_dead_letters().
+"""
+
+import json
+import logging
+import os
+import time
+
+import redis
+import requests
+from celery import Task
+from celery.exceptions import Retry
+
+from celery_app import app, get_redis
+
+FETCH_MAX_RETRIES = int(os.environ.get("FETCH_MAX_RETRIES", 5))
+FETCH_RETRY_BACKOFF_MAX = int(os.environ.get("FETCH_RETRY_BACKOFF_MAX", 600))  # сек, потолок задержки
+DEAD_LETTER_KEY = "dead_letter"
+DEAD_LETTER_MAX = int(os.environ.get("DEAD_LETTER_MAX", 100000))
+
+SUCCESS = "success"
+TRANSIENT = "transient"
+BLOCKED = "blocked"
+NOT_FOUND = "not_found"
+PARSE_FAILED = "parse_failed"
+
+
+class FetchError(Exception):
+    """
+    Неудачный исход загрузки/разбора. Аргументы (message, url) сохраняются в args,
+    чтобы исключение восстанавливалось из result backend
+    """
+    kind = None
+
+    def __init__(self, message: str, url: str = None):
+        super().__init__(message, url)
+        self.message = message
+        self.url = url
+
+    def __str__(self):
+        return f"{self.kind}: {self.message}" + (f" ({self.url})" if self.url else "")
+
+
+class TransientFetchError(FetchError):
+    kind = TRANSIENT
+
+
+class BlockedError(FetchError):
+    kind = BLOCKED
+
+
+class NotFoundError(FetchError):
+    kind = NOT_FOUND
+
+
+class ParseFailedError(FetchError):
+    kind = PARSE_FAILED
+
+
+def _is_webdriver_error(exc: Exception) -> bool:
+    # selenium здесь не импортируется: модуль нужен и HTTP части без браузера
+    return any(cls.__name__ == "WebDriverException" for cls in type(exc).__mro__)
+
+
+def classify(exc: Exception, url: str = None) -> FetchError:
+    """
+    Привести исключение загрузки к типизированному исходу
+    """
+    if isinstance(exc, FetchError):
+        return exc
+    # readiness.PageNotReadyError: застряли на challenge - блокировка, иначе медленная страница
+    state = getattr(exc, "state", None)
+    if state == "challenge":
+        return BlockedError(str(exc), url)
+    if state is not None:
+        return TransientFetchError(str(exc), url)
+    if isinstance(exc, (requests.RequestException, OSError)) or _is_webdriver_error(exc):
+        return TransientFetchError(f"{type(exc).__name__}: {exc}", url)
+    # Неизвестная ошибка тоже повторяется: после FETCH_MAX_RETRIES попадет в dead-letter
+    return TransientFetchError(f"{type(exc).__name__}: {exc}", url)
+
+
+#  -----------------------------------------------------------------------------------------
+#   Dead-letter
+#  -----------------------------------------------------------------------------------------
+
+def push_dead_letter(entry: dict):
+    entry.setdefault("failed_at", time.time())
+    try:
+        pipe = get_redis().pipeline()
+        pipe.lpush(DEAD_LETTER_KEY, json.dumps(entry, default=str))
+        pipe.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_MAX - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.error(f"Не удалось записать в dead-letter: {e}; {entry}")
+
+
+def dead_letter_count() -> int:
+    return get_redis().llen(DEAD_LETTER_KEY)
+
+
+def replay_dead_letters(limit: int = 100, kind: str = None) -> int:
+    """
+    Повторить до limit самых старых записей (только kind, если задан).
+    Задача отправляется заново с остатком своей цепочки и errback'ами
+    """
+    r = get_redis()
+    replayed = 0
+    skipped = []
+    for _ in range(limit):
+        raw = r.rpop(DEAD_LETTER_KEY)
+        if raw is None:
+            break
+        entry = json.loads(raw)
+        if kind and entry.get("kind") != kind:
+            skipped.append(raw)
+            continue
+        app.send_task(entry["task"], args=entry.get("args"), kwargs=entry.get("kwargs"),
+                      chain=entry.get("chain"), link=entry.get("callbacks"), link_error=entry.get("errbacks"))
+        replayed += 1
+    if skipped:
+        # Вернуть пропущенные в хвост в прежнем порядке
+        r.rpush(DEAD_LETTER_KEY, *reversed(skipped))
+    return replayed
+
+
+class FetchTask(Task):
+    """
+    Базовый класс задач загрузки и разбора: TransientFetchError повторяется
+    с экспоненциальной задержкой и jitter, окончательная неудача - в dead-letter.
+    Ожидания (requeue) попыток не расходуют: request.retries - только транзитные ошибки
+    """
+    autoretry_for = (TransientFetchError,)
+    retry_backoff = True
+    retry_backoff_max = FETCH_RETRY_BACKOFF_MAX
+    retry_jitter = True
+    max_retries = FETCH_MAX_RETRIES
+
+    def requeue(self, exc: Exception, countdown: float, max_requeues: int = None):
+        """
+        Перезапустить задачу через countdown сек с тем же request.retries (self.retry
+        увеличил бы его, и после FETCH_MAX_RETRIES ожиданий первая же ошибка сети
+        уходила бы в dead-letter без повторов). Перезапуски считаются по типу
+        исключения в заголовке requeues; больше max_requeues - задача падает с exc
+        """
+        request = self.request
+        requeues = dict(getattr(request, "requeues", None) or (request.headers or {}).get("requeues") or {})
+        kind = type(exc).__name__
+        requeues[kind] = requeues.get(kind, 0) + 1
+        if max_requeues is not None and requeues[kind] > max_requeues:
+            raise exc
+        if request.is_eager:
+            raise self.retry(exc=exc, countdown=countdown, max_retries=None)
+        self.signature_from_request(request, countdown=countdown, retries=request.retries,
+                                    headers={"requeues": requeues}).apply_async()
+        raise Retry(exc=exc, when=countdown)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        error = classify(exc)
+        print(f"Неудача {self.name} [{error.kind}]: {error}")
+        if error.kind == NOT_FOUND:
+            return
+        request = self.request
+        push_dead_letter({
+            "task": self.name,
+            "task_id": task_id,
+            "kind": error.kind,
+            "error": str(error),
+            "url": error.url,
+            "args": list(args or []),
+            "kwargs": dict(kwargs or {}),
+            "chain": request.chain,
+            "callbacks": request.callbacks,
+            "errbacks": request.errbacks,
+        })
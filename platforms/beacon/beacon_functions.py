@@ -4,16 +4,23 @@ Beacon by Schneider Corp scraper functions
 Поддержка: Maricopa County AZ, King County WA, Hillsborough County FL и др.
 """
 
-import os
 import re
 from bs4 import BeautifulSoup
-from sbvirtualdisplay import Display
+from celery import group
+from celery.exceptions import SoftTimeLimitExceeded
 from seleniumbase import SB
 
+from blob_store import load_html
+from browser_pool import browser_session
 from celery_app import app
-from functions import scraper_pass_modal, save_json, scraper_pass_challenge, make_sites_visited_history
+from frontier import Frontier
+from functions import scraper_pass_modal, save_json, scraper_pass_challenge, generate_name
+from harvest import harvest_attr, harvest_options
+from rate_limiter import acquire
+from time_budget import COUNTY_ENUM_RETRIES, mark_timed_out, extended_budget
 
-os.environ['DISPLAY'] = ':99'
+# Пункты списка округов (кроме группы недавно открытых)
+COUNTY_OPTION_SELECTOR = ".state-group:not([aria-labelledby='mru-group']) .dropdown-option:not(#mru-group)"
 
 
 @app.task
@@ -23,72 +30,89 @@ def beacon_scrape_counties_urls_task(base_url: str) -> dict:
     """
     counties_urls = {}
 
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print(f'Display is alive: {disp.is_alive()}')
-
-        with SB(uc=True, headless=False) as sb:
-            make_sites_visited_history(sb)
-            sb.uc_open_with_reconnect(base_url, 2)
-            scraper_pass_challenge(sb)
-            scraper_pass_modal(sb)
-
-            # Beacon использует похожий dropdown
-            try:
-                area_menu_input = sb.find_element("areaMenuButton", by="id")
-                state_groups = sb.find_elements("state-group", by="class name")
-
-                for state_group in state_groups:
-                    if state_group.get_attribute('aria-labelledby') == "mru-group":
-                        continue
-
-                    counties = state_group.find_elements(value="dropdown-option", by="class name")
-
-                    for county in counties:
-                        if county.get_attribute("id") == "mru-group":
-                            continue
-
-                        area_menu_input.click()
-                        county.click()
-                        county_name = sb.get_text("areaMenuButton", by="id")
-                        county_url = sb.find_element("track-mru", by="class name").get_attribute("href")
-                        print(f"County URL: {county_url}")
-                        counties_urls[county_name] = county_url
-            except Exception as e:
-                print(f"Error getting counties: {e}")
-                # Если нет dropdown, возможно прямой URL
-                counties_urls[base_url] = base_url
+    with browser_session() as sb:
+        acquire(base_url)
+        sb.uc_open_with_reconnect(base_url, 2)
+        scraper_pass_challenge(sb, "beacon")
+        scraper_pass_modal(sb, "beacon")
+
+        # Beacon использует похожий dropdown
+        try:
+            area_menu_input = sb.find_element("areaMenuButton", by="id")
+            county_elements = None
+
+            # Все пункты списка округов одним вызовом JS
+            for option in harvest_options(sb, COUNTY_OPTION_SELECTOR):
+                county_name, county_url = option["text"], option["href"]
+
+                if not county_url:
+                    # Ссылка на округ появляется только после выбора пункта
+                    if county_elements is None:
+                        county_elements = sb.find_elements(COUNTY_OPTION_SELECTOR, by="css selector")
+                    area_menu_input.click()
+                    county_elements[option["index"]].click()
+                    county_name = sb.get_text("areaMenuButton", by="id")
+                    county_url = sb.find_element("track-mru", by="class name").get_attribute("href")
+
+                print(f"County URL: {county_url}")
+                counties_urls[county_name] = county_url
+        except Exception as e:
+            print(f"Error getting counties: {e}")
+            # Если нет dropdown, возможно прямой URL
+            counties_urls[base_url] = base_url
 
     return counties_urls
 
 
 @app.task
-def beacon_get_all_parcels_urls_task(counties_urls: dict) -> list:
+def beacon_get_all_parcels_urls_task(counties_urls: dict) -> int:
     """
-    Получить все parcel URLs для Beacon округов
+    Получить все parcel URLs для Beacon округов: отдельная задача на каждый округ,
+    parcels попадают во frontier "beacon" по мере готовности округов
     """
-    all_counties_parcels_urls = []
-
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print(f'Display is alive: {disp.is_alive()}')
+    group(beacon_enumerate_county_task.s(name, url) for name, url in counties_urls.items())()
+    return len(counties_urls)
 
-        with SB(uc=True, headless=False) as sb:
-            for name, url in counties_urls.items():
-                county_parcels_urls = beacon_get_county_parcels_urls_task(sb, url)
-                all_counties_parcels_urls.extend(county_parcels_urls)
 
-    return all_counties_parcels_urls
-
-
-def beacon_get_county_parcels_urls_task(sb: SB, url: str) -> list:
+# Лимиты времени - адаптивные (time_budget.py), до первых замеров COUNTY_ENUM_TIMEOUT
+@app.task(bind=True, autoretry_for=(Exception,), max_retries=COUNTY_ENUM_RETRIES, retry_backoff=60)
+def beacon_enumerate_county_task(self, name: str, url: str) -> int:
     """
-    Получить URLs всех parcels для одного Beacon округа
+    Перебор parcels одного округа в своем браузере; ошибка или таймаут - повтор только этого округа
     """
     county_parcels_urls = []
+    try:
+        with browser_session() as sb:
+            beacon_get_county_parcels_urls_task(sb, url, county_parcels_urls)
+    except SoftTimeLimitExceeded as e:
+        # Замер "не меньше лимита" поднимает бюджет следующих переборов
+        mark_timed_out(censored=True)
+        if not county_parcels_urls:
+            # С тем же лимитом округ снова не уложится - повтор с увеличенным
+            soft, hard = extended_budget()
+            print(f"{name}: перебор не уложился в лимит, повтор с лимитом {soft} сек")
+            raise self.retry(exc=e, countdown=60, soft_time_limit=soft, time_limit=hard)
+        print(f"{name}: лимит времени исчерпан после сбора списка, сохраняем собранное")
+
+    save_json(county_parcels_urls, "beacon", generate_name("beacon", f"{name}_parcels_urls"))
+
+    added = Frontier("beacon").enqueue(county_parcels_urls, meta={"county": name})
+    print(f"{name}: {len(county_parcels_urls)} parcels, новых во frontier: {added}")
+    return added
+
+
+def beacon_get_county_parcels_urls_task(sb: SB, url: str, found: list = None) -> list:
+    """
+    Получить URLs всех parcels для одного Beacon округа.
+    found - список для заполнения (собранное остается в нем при прерывании)
+    """
+    county_parcels_urls = [] if found is None else found
 
     try:
+        acquire(url)
         sb.uc_open_with_reconnect(url, 2)
-        scraper_pass_challenge(sb)
-        scraper_pass_modal(sb)
+        scraper_pass_challenge(sb, "beacon")
+        scraper_pass_modal(sb, "beacon")
 
         # Beacon может иметь разные селекторы для поиска
         search_selectors = [
@@ -106,7 +130,7 @@ def beacon_get_county_parcels_urls_task(sb: SB, url: str) -> list:
 
         # Нажать кнопку поиска (получить все результаты)
         sb.js_click_if_visible(selector="[id*='_ctl01_btnSearch']", by="css selector", timeout=3)
-        scraper_pass_modal(sb)
+        scraper_pass_modal(sb, "beacon")
 
         # Получить ссылки на parcels
         parcel_selectors = [
@@ -115,24 +139,17 @@ def beacon_get_county_parcels_urls_task(sb: SB, url: str) -> list:
             "a[href*='parcel']"
         ]
         
-        urls = []
-        for selector in parcel_selectors:
-            try:
-                urls = sb.find_elements(selector=selector, by="css selector")
-                if len(urls) > 0:
-                    break
-            except:
-                continue
+        # Первый сработавший селектор, все ссылки одним вызовом JS
+        county_parcels_urls.extend(harvest_attr(sb, parcel_selectors))
 
-        if not len(urls) > 0:
+        if not len(county_parcels_urls) > 0:
             raise Exception("Не удалось получить список parcels")
 
-        for parcel_url in urls:
-            county_parcels_urls.append(parcel_url.get_attribute("href"))
-
     except Exception as e:
         print(f"{url} -> Error")
         print(e)
+        # Ошибку обрабатывает задача округа (повтор)
+        raise
 
     return county_parcels_urls
 
@@ -144,7 +161,7 @@ def beacon_parse_single_html_task(html: str) -> dict:
     
     Beacon часто имеет больше данных, чем базовый QPublic
     """
-    doc = BeautifulSoup(html, "html.parser")
+    doc = BeautifulSoup(load_html(html), "html.parser")
     
     data = {}
     
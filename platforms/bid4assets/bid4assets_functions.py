@@ -9,13 +9,23 @@ import re
 import json
 from datetime import datetime
 from bs4 import BeautifulSoup
-from sbvirtualdisplay import Display
-from seleniumbase import SB
+from celery import chain, chord, group
+from celery.exceptions import SoftTimeLimitExceeded
 
+from blob_store import load_html
+from browser_pool import browser_session
+from canonical import canonical_url
 from celery_app import app
-from functions import save_json
+from frontier import Frontier
+from functions import save_json, append_jsonl, scraper_pass_challenge
+from harvest import harvest_attr
+from outcomes import NotFoundError
+from rate_limiter import acquire, RateLimited
+from tab_fetcher import fetch_many
+from time_budget import mark_timed_out
 
-os.environ['DISPLAY'] = ':99'
+# Properties на одну задачу загрузки (грузятся во вкладках одного браузера)
+BID4ASSETS_BATCH_SIZE = int(os.environ.get("BID4ASSETS_BATCH_SIZE", 20))
 
 
 @app.task
@@ -37,52 +47,50 @@ def bid4assets_get_auction_calendar(base_url: str = "https://www.bid4assets.com"
     """
     auction_calendar = {}
 
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print(f'Display is alive: {disp.is_alive()}')
+    with browser_session() as sb:
+        # Открыть страницу с календарем
+        calendar_url = f"{base_url}/SalesCalendar"
+        acquire(calendar_url)
+        sb.uc_open_with_reconnect(calendar_url, 2)
+        scraper_pass_challenge(sb, "bid4assets")
 
-        with SB(uc=True, headless=False) as sb:
-            # Открыть страницу с календарем
-            calendar_url = f"{base_url}/SalesCalendar"
-            sb.uc_open_with_reconnect(calendar_url, 2)
-            sb.sleep(2)
+        # Bid4Assets использует календарную структуру
+        # Получить HTML
+        html = sb.get_page_source()
+        doc = BeautifulSoup(html, "html.parser")
 
-            # Bid4Assets использует календарную структуру
-            # Получить HTML
-            html = sb.get_page_source()
-            doc = BeautifulSoup(html, "html.parser")
+        # Найти все предстоящие аукционы
+        auction_items = doc.find_all(class_=re.compile("auction-item|sale-item", re.IGNORECASE))
 
-            # Найти все предстоящие аукционы
-            auction_items = doc.find_all(class_=re.compile("auction-item|sale-item", re.IGNORECASE))
+        for item in auction_items:
+            try:
+                # Извлечь информацию об аукционе
+                state = item.find(class_=re.compile("state"))
+                county = item.find(class_=re.compile("county|jurisdiction"))
+                date = item.find(class_=re.compile("date|sale-date"))
+                auction_type = item.find(class_=re.compile("type|sale-type"))
+                link = item.find('a', href=True)
+                count = item.find(class_=re.compile("count|properties"))
 
-            for item in auction_items:
-                try:
-                    # Извлечь информацию об аукционе
-                    state = item.find(class_=re.compile("state"))
-                    county = item.find(class_=re.compile("county|jurisdiction"))
-                    date = item.find(class_=re.compile("date|sale-date"))
-                    auction_type = item.find(class_=re.compile("type|sale-type"))
-                    link = item.find('a', href=True)
-                    count = item.find(class_=re.compile("count|properties"))
-
-                    if state and county and date:
-                        state_name = state.text.strip()
-                        county_name = county.text.strip()
+                if state and county and date:
+                    state_name = state.text.strip()
+                    county_name = county.text.strip()
                         
-                        if state_name not in auction_calendar:
-                            auction_calendar[state_name] = {}
+                    if state_name not in auction_calendar:
+                        auction_calendar[state_name] = {}
                         
-                        auction_calendar[state_name][county_name] = {
-                            'auction_date': date.text.strip(),
-                            'auction_type': auction_type.text.strip() if auction_type else 'unknown',
-                            'auction_url': link['href'] if link else '',
-                            'properties_count': int(count.text.strip()) if count else 0
-                        }
+                    auction_calendar[state_name][county_name] = {
+                        'auction_date': date.text.strip(),
+                        'auction_type': auction_type.text.strip() if auction_type else 'unknown',
+                        'auction_url': link['href'] if link else '',
+                        'properties_count': int(count.text.strip()) if count else 0
+                    }
                         
-                        print(f"Found: {state_name} - {county_name} on {date.text.strip()}")
+                    print(f"Found: {state_name} - {county_name} on {date.text.strip()}")
 
-                except Exception as e:
-                    print(f"Error parsing auction item: {e}")
-                    continue
+            except Exception as e:
+                print(f"Error parsing auction item: {e}")
+                continue
 
     return auction_calendar
 
@@ -98,27 +106,25 @@ def bid4assets_get_auction_properties(auction_url: str) -> list:
     Returns:
         list: список URLs отдельных properties
     """
-    property_urls = []
+    # Дедупликация по каноническому URL с сохранением порядка
+    property_urls = {}
 
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        with SB(uc=True, headless=False) as sb:
+    page = 1
+    try:
+        with browser_session() as sb:
+            acquire(auction_url)
             sb.uc_open_with_reconnect(auction_url, 2)
-            sb.sleep(2)
+            scraper_pass_challenge(sb, "bid4assets")
 
             # Bid4Assets может использовать пагинацию
-            page = 1
             max_pages = 100  # Защита от бесконечного цикла
 
             while page <= max_pages:
                 print(f"Processing page {page}")
                 
                 # Получить ссылки на properties
-                property_links = sb.find_elements("a[href*='/Item/']", by="css selector")
-                
-                for link in property_links:
-                    url = link.get_attribute("href")
-                    if url and url not in property_urls:
-                        property_urls.append(url)
+                for url in harvest_attr(sb, "a[href*='/Item/']"):
+                    property_urls.setdefault(canonical_url(url), url)
                 
                 # Проверить наличие кнопки "Next"
                 try:
@@ -129,10 +135,19 @@ def bid4assets_get_auction_properties(auction_url: str) -> list:
                         page += 1
                     else:
                         break
+                except SoftTimeLimitExceeded:
+                    raise
                 except:
                     break  # Больше нет страниц
+    except SoftTimeLimitExceeded:
+        if not property_urls:
+            raise
+        mark_timed_out()
+        # Бюджет времени задачи исчерпан (time_budget.py): отдаем properties с пройденных страниц,
+        # повторный запуск аукциона добавит остальные - frontier отсеет уже известные
+        print(f"Бюджет времени исчерпан на странице {page}: {len(property_urls)} properties")
 
-    return property_urls
+    return list(property_urls.values())
 
 
 @app.task
@@ -149,7 +164,7 @@ def bid4assets_parse_single_property(html: str) -> dict:
     - Tax information
     - Property images
     """
-    doc = BeautifulSoup(html, "html.parser")
+    doc = BeautifulSoup(load_html(html), "html.parser")
     
     data = {}
     
@@ -312,8 +327,8 @@ def bid4assets_parse_single_property(html: str) -> dict:
     return data
 
 
-@app.task
-def bid4assets_scrape_full_auction(auction_url: str, county: str) -> dict:
+@app.task(bind=True)
+def bid4assets_scrape_full_auction(self, auction_url: str, county: str) -> dict:
     """
     Полный скрапинг аукциона: получить все properties и их детали
     
@@ -323,47 +338,128 @@ def bid4assets_scrape_full_auction(auction_url: str, county: str) -> dict:
     
     Returns:
         dict: сводная информация
+
+    Задача заменяется цепочкой (список properties -> скрапинг), поэтому
+    .get() на ней вернет сводку, не занимая воркер ожиданием
     """
     print(f"Starting full auction scrape: {auction_url}")
-    
-    # 1. Получить список всех properties
-    property_urls = bid4assets_get_auction_properties.apply_async(
-        args=[auction_url]
-    ).get()
-    
+
+    raise self.replace(chain(
+        bid4assets_get_auction_properties.s(auction_url),
+        bid4assets_scrape_auction_properties.s(auction_url, county),
+    ))
+
+
+@app.task(bind=True)
+def bid4assets_scrape_auction_properties(self, property_urls: list, auction_url: str, county: str) -> dict:
+    """
+    Скрапинг всех properties аукциона по списку URL: пачки properties грузятся
+    параллельными задачами (браузеры из пула воркеров), сводку пишет колбэк chord'а
+    """
     print(f"Found {len(property_urls)} properties")
     
     # 2. Сохранить список URLs
     save_json({'property_urls': property_urls}, "bid4assets", f"{county}_urls")
     
-    # 3. Скрапить каждый property (можно распараллелить)
-    all_properties = []
-    
-    for idx, prop_url in enumerate(property_urls):
-        print(f"Scraping property {idx+1}/{len(property_urls)}: {prop_url}")
-        
-        with Display(visible=False, size=(1920, 1080)) as disp:
-            with SB(uc=True, headless=False) as sb:
-                sb.uc_open_with_reconnect(prop_url, 2)
-                sb.sleep(1)
-                html = sb.get_page_source()
-                
-                property_data = bid4assets_parse_single_property(html)
-                property_data['property_url'] = prop_url
-                all_properties.append(property_data)
-        
-        # Сохранять промежуточные результаты каждые 50 properties
-        if (idx + 1) % 50 == 0:
-            save_json({'properties': all_properties}, "bid4assets", f"{county}_partial_{idx+1}")
-    
-    # 4. Сохранить все данные
-    save_json({'properties': all_properties}, "bid4assets", f"{county}_complete")
-    
-    return {
-        'total_properties': len(all_properties),
+    # 3. Properties из frontier аукциона: после перезапуска уже обработанные
+    # повторно не загружаются
+    frontier = Frontier(f"bid4assets:{county}")
+    frontier.enqueue(property_urls)
+
+    batches = []
+    while True:
+        batch = frontier.lease(BID4ASSETS_BATCH_SIZE)
+        if not batch:
+            break
+        batches.append([(key, prop_url) for key, prop_url, _ in batch])
+
+    print(f"Scraping {sum(len(batch) for batch in batches)} properties in {len(batches)} tasks")
+
+    # 4. Параллельная загрузка, сводка - по завершении всех пачек
+    summary = bid4assets_auction_summary_task.s(auction_url, county)
+    if not batches:
+        raise self.replace(summary.clone(args=([],)))
+    raise self.replace(chord(
+        group(bid4assets_fetch_properties_task.s(county, batch) for batch in batches),
+        summary,
+    ))
+
+
+@app.task(bind=True, max_retries=3)
+def bid4assets_fetch_properties_task(self, county: str, batch: list) -> dict:
+    """
+    Загрузить пачку properties во вкладках браузера из пула и дописать записи в JSONL
+    """
+    frontier = Frontier(f"bid4assets:{county}")
+    pages = {}
+    errors = {}
+    # Пачка прервана: (причина, через сколько сек повторить) - незагруженное возвращается во frontier
+    interrupted = None
+    try:
+        fetch_many([prop_url for _, prop_url in batch], platform="bid4assets", results=pages, errors=errors)
+    except RateLimited as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=e.retry_after)
+        # Повторы кончились, но сводка аукциона (chord) должна получить результат пачки
+        interrupted = ("rate limited", e.retry_after)
+    except SoftTimeLimitExceeded:
+        # Бюджет времени исчерпан: разбираем загруженное, остальное возвращается во frontier
+        interrupted = ("time budget", 0)
+        mark_timed_out()
+        print(f"Бюджет времени исчерпан: загружено {len(pages)} из {len(batch)} properties")
+
+    properties = []
+    done_keys = []
+    failed = 0
+    parked = 0
+    for key, prop_url in batch:
+        if prop_url in errors:
+            # 404 - property снят с аукциона, повторять незачем
+            e = errors[prop_url]
+            frontier.fail(key, error=str(e), final=isinstance(e, NotFoundError))
+            failed += 1
+            continue
+        if pages.get(prop_url) is None and interrupted:
+            reason, delay = interrupted
+            frontier.park(key, delay, reason=reason)
+            parked += 1
+            continue
+        try:
+            property_data = bid4assets_parse_single_property(pages[prop_url])
+        except Exception as e:
+            frontier.fail(key, error=str(e))
+            failed += 1
+            continue
+        property_data['id'] = key  # ID parcel (ключ frontier)
+        property_data['property_url'] = prop_url
+        properties.append(property_data)
+        done_keys.append(key)
+
+    # Дописываем только новые записи, а не весь накопленный список
+    append_jsonl(properties, "bid4assets", f"{county}_properties")
+    for key in done_keys:
+        frontier.done(key)
+
+    return {'done': len(properties), 'failed': failed, 'parked': parked}
+
+
+@app.task
+def bid4assets_auction_summary_task(results: list, auction_url: str, county: str) -> dict:
+    """
+    Сводка по аукциону после загрузки всех пачек
+    """
+    summary = {
+        'total_properties': sum(result['done'] for result in results),
+        'failed_properties': sum(result['failed'] for result in results),
+        'parked_properties': sum(result.get('parked', 0) for result in results),
+        'frontier': Frontier(f"bid4assets:{county}").stats(),
+        'properties_file': f"./storage/bid4assets/{county}_properties.jsonl",
         'auction_url': auction_url,
         'county': county
     }
+    save_json(summary, "bid4assets", f"{county}_complete")
+    print(f"Auction scraped: {summary}")
+    return summary
 
 
 # Пример использования
@@ -1,16 +1,22 @@
-import os
 import re
 import time
 
-# from pyvirtualdisplay import Display
-from sbvirtualdisplay import Display
 from seleniumbase import SB
 from bs4 import BeautifulSoup
+from celery import group
+from celery.exceptions import SoftTimeLimitExceeded
 
+from blob_store import load_html
+from browser_pool import browser_session
 from celery_app import app
-from functions import scraper_pass_modal, save_json, scraper_pass_challenge, make_sites_visited_history
+from frontier import Frontier
+from functions import scraper_pass_modal, save_json, scraper_pass_challenge, generate_name
+from harvest import harvest_attr, harvest_options
+from rate_limiter import acquire
+from time_budget import COUNTY_ENUM_RETRIES, mark_timed_out, extended_budget
 
-os.environ['DISPLAY'] = ':99'
+# Пункты списка округов (кроме группы недавно открытых)
+COUNTY_OPTION_SELECTOR = ".state-group:not([aria-labelledby='mru-group']) .dropdown-option:not(#mru-group)"
 
 
 # with SB(uc=True, headless=False, headless=headless, block_images=block_images) as sb:
@@ -19,95 +25,119 @@ os.environ['DISPLAY'] = ':99'
 def qpublic_scrape_counties_urls_task(url: str) -> dict:
     counties_urls = {}
 
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print(f'Display is alive: {disp.is_alive()}')
-
-        with SB(uc=True, headless=False) as sb:
-            make_sites_visited_history(sb)
-            sb.uc_open_with_reconnect(url, 2)
-            scraper_pass_challenge(sb)
-
-            scraper_pass_modal(sb)
+    with browser_session() as sb:
+        acquire(url)
+        sb.uc_open_with_reconnect(url, 2)
+        scraper_pass_challenge(sb, "qpublic")
 
-            # by или selector: 'css selector', 'link text', 'partial link text', 'name', 'xpath', 'id', 'tag name', 'class name'
+        scraper_pass_modal(sb, "qpublic")
 
-            area_menu_input = sb.find_element("areaMenuButton", by="id")
-            state_groups = sb.find_elements("state-group", by="class name")
+        # by или selector: 'css selector', 'link text', 'partial link text', 'name', 'xpath', 'id', 'tag name', 'class name'
 
-            for state_group in state_groups:
-                if state_group.get_attribute('aria-labelledby') == "mru-group":
-                    continue
+        area_menu_input = sb.find_element("areaMenuButton", by="id")
+        county_elements = None
 
-                counties = state_group.find_elements(value="dropdown-option", by="class name")
+        # Все пункты списка округов одним вызовом JS
+        for option in harvest_options(sb, COUNTY_OPTION_SELECTOR):
+            county_name, county_url = option["text"], option["href"]
 
-                for county in counties:
-                    if county.get_attribute("id") == "mru-group":
-                        continue
+            if not county_url:
+                # Ссылка на округ появляется только после выбора пункта
+                if county_elements is None:
+                    county_elements = sb.find_elements(COUNTY_OPTION_SELECTOR, by="css selector")
+                area_menu_input.click()
+                county_elements[option["index"]].click()
+                county_name = sb.get_text("areaMenuButton", by="id")
+                county_url = sb.find_element("track-mru", by="class name").get_attribute("href")
 
-                    area_menu_input.click()
-                    county.click()
-                    county_name = sb.get_text("areaMenuButton", by="id")
-                    county_url = sb.find_element("track-mru", by="class name").get_attribute("href")
-                    print(f"County URL: {county_url}")
-                    counties_urls[county_name] = county_url
+            print(f"County URL: {county_url}")
+            counties_urls[county_name] = county_url
 
-                    # 18.02.2025: Тест
-                    if county_name == "Crawford County, AR":
-                        return {county_name: county_url}
+            # 18.02.2025: Тест
+            if county_name == "Crawford County, AR":
+                return {county_name: county_url}
 
     # 18.02.2025: Отключаем для теста
     # return counties_urls
 
 
 @app.task
-def qpublic_get_all_parcels_urls_task(counties_urls: dict) -> list:
-    all_counties_parcels_urls = []
-
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print(f'Display is alive: {disp.is_alive()}')
-
-        with SB(uc=True, headless=False) as sb:
-            for name, url in counties_urls.items():
-                county_parcels_urls = qpublic_get_county_parcels_urls_task(sb, url)
-                all_counties_parcels_urls.extend(county_parcels_urls)
-
-    return all_counties_parcels_urls
-
-
-@app.task
-def qpublic_get_county_parcels_urls_task(sb: SB, url: str) -> list:
+def qpublic_get_all_parcels_urls_task(counties_urls: dict) -> int:
+    """
+    Запустить перебор parcels параллельно: отдельная задача на каждый округ.
+    Parcels попадают во frontier "qpublic" по мере готовности округов
+    """
+    group(qpublic_enumerate_county_task.s(name, url) for name, url in counties_urls.items())()
+    return len(counties_urls)
+
+
+# Лимиты времени - адаптивные (time_budget.py), до первых замеров COUNTY_ENUM_TIMEOUT
+@app.task(bind=True, autoretry_for=(Exception,), max_retries=COUNTY_ENUM_RETRIES, retry_backoff=60)
+def qpublic_enumerate_county_task(self, name: str, url: str) -> int:
+    """
+    Перебор parcels одного округа в своем браузере; ошибка или таймаут - повтор только этого округа
+    """
     county_parcels_urls = []
+    try:
+        with browser_session() as sb:
+            qpublic_get_county_parcels_urls_task(sb, url, county_parcels_urls)
+    except SoftTimeLimitExceeded as e:
+        # Замер "не меньше лимита" поднимает бюджет следующих переборов
+        mark_timed_out(censored=True)
+        if not county_parcels_urls:
+            # С тем же лимитом округ снова не уложится - повтор с увеличенным
+            soft, hard = extended_budget()
+            print(f"{name}: перебор не уложился в лимит, повтор с лимитом {soft} сек")
+            raise self.retry(exc=e, countdown=60, soft_time_limit=soft, time_limit=hard)
+        print(f"{name}: лимит времени исчерпан после сбора списка, сохраняем собранное")
+
+    save_json(county_parcels_urls, "qpublic", generate_name("qpublic", f"{name}_parcels_urls"))
+
+    # !!! Урезаем количество url до 10 для теста !!!
+    county_parcels_urls = county_parcels_urls[:10]
+
+    added = Frontier("qpublic").enqueue(county_parcels_urls, meta={"county": name})
+    print(f"{name}: {len(county_parcels_urls)} parcels, новых во frontier: {added}")
+    app.signature("tasks.frontier_dispatch_task", args=("qpublic",)).delay()
+    return added
+
+
+def qpublic_get_county_parcels_urls_task(sb: SB, url: str, found: list = None) -> list:
+    """
+    URLs всех parcels одного округа. found - список для заполнения (собранное остается в нем при прерывании)
+    """
+    county_parcels_urls = [] if found is None else found
 
     try:
+        acquire(url)
         sb.uc_open_with_reconnect(url, 2)
-        scraper_pass_challenge(sb)
-        scraper_pass_modal(sb)
+        scraper_pass_challenge(sb, "qpublic")
+        scraper_pass_modal(sb, "qpublic")
 
         sb.js_click_if_visible(selector="[class*='tt-upm-address-search-btn']", by="css selector", timeout=3)
         sb.js_click_if_visible(selector="[id*='_ctl01_btnSearch']", by="css selector", timeout=3)
-        scraper_pass_modal(sb)
+        scraper_pass_modal(sb, "qpublic")
 
-        urls = sb.find_elements(selector="[id*='_lnkParcelID']", by="css selector")
+        # Все ссылки одним вызовом JS, а не get_attribute на каждый элемент
+        county_parcels_urls.extend(harvest_attr(sb, "[id*='_lnkParcelID']"))
 
-        if not len(urls) > 0:
+        if not len(county_parcels_urls) > 0:
             raise Exception("Не удалось получить список parcels")
 
-        for parcel_url in urls:
-            county_parcels_urls.append(parcel_url.get_attribute("href"))
-
         # print(f"{name} -> OK")
 
     except Exception as e:
         print(f"{url} -> Error")
         print(e)
-        # error_urls.append(url)
+        # Ошибку обрабатывает задача округа (повтор)
+        raise
 
     return county_parcels_urls
 
 
 @app.task
 def qpublic_parse_single_html_task(html: str) -> dict:
-    doc = BeautifulSoup(html, "html.parser")
+    doc = BeautifulSoup(load_html(html), "html.parser")
 
     info_table = doc.find(class_=re.compile("tabular-data-two-column"))
     parcel_id = info_table.find(id=re.compile("_lblParcelID")).text
@@ -6,13 +6,27 @@ Tyler Technologies (iasWorld) scraper functions
 import os
 import re
 from bs4 import BeautifulSoup
-from sbvirtualdisplay import Display
-from seleniumbase import SB
+from celery import group
 
-from celery_app import app
+from blob_store import load_html
+from browser_pool import browser_session
+from canonical import canonical_url
+from celery_app import app, get_redis
+from frontier import Frontier
 from functions import scraper_pass_modal, save_json, scraper_pass_challenge
+from harvest import harvest, harvest_attr, harvest_html
+from rate_limiter import acquire
 
-os.environ['DISPLAY'] = ':99'
+# Максимум результатов, который показывает поиск Tyler (больше - выдача обрезана)
+TYLER_RESULT_CAP = int(os.environ.get("TYLER_RESULT_CAP", 1000))
+# Предел длины префикса владельца при дроблении поиска
+TYLER_MAX_PREFIX_LEN = int(os.environ.get("TYLER_MAX_PREFIX_LEN", 4))
+# Символы префиксов: имена владельцев бывают и с пунктуацией (&, O'BRIEN, ST. JOHN, SMITH-JONES)
+TYLER_PREFIX_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789&'-.,()/"
+# Строки выдачи поиска (текст строки содержит имя владельца)
+TYLER_RESULT_ROW_SELECTOR = "tr:has(a[href*='ParcelID'])"
+TRUNCATED_RESULTS_PATTERN = re.compile(r"too many (results|records)|refine your search|only the first \d+|"
+                                       r"limited to \d+", re.IGNORECASE)
 
 
 @app.task
@@ -22,21 +36,18 @@ def tyler_scrape_counties_urls_task(base_url: str) -> dict:
     """
     counties_urls = {}
 
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print(f'Display is alive: {disp.is_alive()}')
-
-        with SB(uc=True, headless=False) as sb:
-            sb.uc_open_with_reconnect(base_url, 2)
-            
-            # Tyler обычно использует dropdown или список ссылок
-            county_links = sb.find_elements("a[href*='County']", by="css selector")
+    with browser_session() as sb:
+        acquire(base_url)
+        sb.uc_open_with_reconnect(base_url, 2)
+        scraper_pass_challenge(sb, "tyler")
             
-            for link in county_links:
-                county_name = link.text
-                county_url = link.get_attribute("href")
-                if county_name and county_url:
-                    counties_urls[county_name] = county_url
-                    print(f"Found: {county_name} -> {county_url}")
+        # Tyler обычно использует dropdown или список ссылок
+        for link in harvest(sb, "a[href*='County']", ("text", "href")):
+            county_name = link["text"]
+            county_url = link["href"]
+            if county_name and county_url:
+                counties_urls[county_name] = county_url
+                print(f"Found: {county_name} -> {county_url}")
 
     return counties_urls
 
@@ -46,25 +57,23 @@ def tyler_get_parcel_search_url(county_url: str) -> str:
     """
     Найти URL для поиска parcels в Tyler iasWorld системе
     """
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        with SB(uc=True, headless=False) as sb:
-            sb.uc_open_with_reconnect(county_url, 2)
+    with browser_session() as sb:
+        acquire(county_url)
+        sb.uc_open_with_reconnect(county_url, 2)
+        scraper_pass_challenge(sb, "tyler")
             
-            # Tyler обычно имеет "Property Search" или "Parcel Search" ссылку
-            search_selectors = [
-                "a[href*='PropertySearch']",
-                "a[href*='ParcelSearch']",
-                "a:contains('Property Search')",
-                "a:contains('Search')"
-            ]
-            
-            for selector in search_selectors:
-                try:
-                    link = sb.find_element(selector, by="css selector")
-                    if link:
-                        return link.get_attribute("href")
-                except:
-                    continue
+        # Tyler обычно имеет "Property Search" или "Parcel Search" ссылку
+        search_selectors = [
+            "a[href*='PropertySearch']",
+            "a[href*='ParcelSearch']",
+            "a:-soup-contains('Property Search')",
+            "a:-soup-contains('Search')"
+        ]
+
+        # Один снимок страницы разбирается без браузера, вместо find_element на каждый селектор
+        links = harvest_html(sb.get_page_source(), search_selectors, base_url=sb.get_current_url())
+        if links and links[0]["href"]:
+            return links[0]["href"]
     
     return county_url
 
@@ -86,59 +95,72 @@ def tyler_search_by_criteria(search_url: str, criteria: dict) -> list:
     Returns:
         list: список URLs найденных parcels
     """
-    parcel_urls = []
-    
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        with SB(uc=True, headless=False) as sb:
-            sb.uc_open_with_reconnect(search_url, 2)
-            
-            # Заполнить форму поиска
-            if 'parcel_number' in criteria:
-                try:
-                    sb.type("input[name*='ParcelID']", criteria['parcel_number'])
-                except:
-                    pass
-            
-            if 'owner_name' in criteria:
-                try:
-                    sb.type("input[name*='Owner']", criteria['owner_name'])
-                except:
-                    pass
-            
-            if 'street_address' in criteria:
-                try:
-                    sb.type("input[name*='Street']", criteria['street_address'])
-                except:
-                    pass
-            
-            # Нажать кнопку поиска
-            search_buttons = [
-                "input[type='submit'][value*='Search']",
-                "button:contains('Search')",
-                "input[id*='btnSearch']"
-            ]
-            
-            for btn_selector in search_buttons:
-                try:
-                    sb.click(btn_selector)
-                    break
-                except:
-                    continue
-            
-            sb.sleep(2)
-            
-            # Получить результаты
-            # Tyler часто показывает таблицу с результатами
-            result_links = sb.find_elements("a[href*='ParcelID']", by="css selector")
-            
-            for link in result_links:
-                url = link.get_attribute("href")
-                if url and url not in parcel_urls:
-                    parcel_urls.append(url)
-    
+    with browser_session() as sb:
+        parcel_urls, _ = tyler_search(sb, search_url, criteria)
+
     return parcel_urls
 
 
+def tyler_search(sb, search_url: str, criteria: dict, result_cap: int = TYLER_RESULT_CAP):
+    """
+    Выполнить поиск в открытом браузере.
+    Возвращает (urls, truncated): truncated - сайт отдал не все результаты (достигнут лимит выдачи)
+    """
+    acquire(search_url)
+    sb.uc_open_with_reconnect(search_url, 2)
+    scraper_pass_challenge(sb, "tyler")
+
+    # Заполнить форму поиска
+    if 'parcel_number' in criteria:
+        try:
+            sb.type("input[name*='ParcelID']", criteria['parcel_number'])
+        except:
+            pass
+
+    if 'owner_name' in criteria:
+        try:
+            sb.type("input[name*='Owner']", criteria['owner_name'])
+        except:
+            pass
+
+    if 'street_address' in criteria:
+        try:
+            sb.type("input[name*='Street']", criteria['street_address'])
+        except:
+            pass
+
+    # Нажать кнопку поиска
+    search_buttons = [
+        "input[type='submit'][value*='Search']",
+        "button:contains('Search')",
+        "input[id*='btnSearch']"
+    ]
+
+    for btn_selector in search_buttons:
+        try:
+            sb.click(btn_selector)
+            break
+        except:
+            continue
+
+    sb.sleep(2)
+
+    # Получить результаты
+    # Tyler часто показывает таблицу с результатами
+    # Дедупликация по каноническому URL с сохранением порядка
+    found = {}
+    for url in harvest_attr(sb, "a[href*='ParcelID']"):
+        found.setdefault(canonical_url(url), url)
+    parcel_urls = list(found.values())
+
+    # Выдача обрезана: результатов ровно столько, сколько сайт показывает максимум,
+    # или сайт прямо просит уточнить поиск
+    truncated = len(parcel_urls) >= result_cap or \
+        TRUNCATED_RESULTS_PATTERN.search(sb.get_text("body") or "") is not None
+
+    return parcel_urls, truncated
+
+
 @app.task
 def tyler_parse_single_html_task(html: str) -> dict:
     """
@@ -149,7 +171,7 @@ def tyler_parse_single_html_task(html: str) -> dict:
     - Таблицы с данными: Owner, Property, Tax, Sales
     - Иногда используют div с id/class patterns
     """
-    doc = BeautifulSoup(html, "html.parser")
+    doc = BeautifulSoup(load_html(html), "html.parser")
     
     data = {}
     
@@ -311,32 +333,89 @@ def tyler_parse_single_html_task(html: str) -> dict:
 
 
 @app.task
-def tyler_scrape_all_parcels_by_letter(search_url: str, county: str) -> list:
+def tyler_scrape_all_parcels_by_letter(search_url: str, county: str, result_cap: int = TYLER_RESULT_CAP) -> dict:
     """
-    Получить все parcels путем поиска по первой букве фамилии владельца (A-Z)
+    Получить все parcels путем поиска по началу фамилии владельца
     Эффективный способ для Tyler систем
+
+    Префиксы A-Z (и цифры) ищутся параллельно, отдельной задачей каждый.
+    Если выдача префикса обрезана лимитом сайта, префикс делится на более
+    длинные (A -> AA..AZ -> AAA..), пока каждая выдача не станет полной.
+    Parcels пишутся во frontier "tyler:<county>" по мере поиска
     """
-    all_parcel_urls = []
-    
-    # Поиск по каждой букве алфавита
-    for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
-        print(f"Searching for owners starting with '{letter}'")
-        
-        criteria = {'owner_name': f"{letter}*"}
-        parcels = tyler_search_by_criteria.apply_async(
-            args=[search_url, criteria]
-        ).get()
-        
-        all_parcel_urls.extend(parcels)
-        
-        # Сохранить промежуточные результаты
-        if len(all_parcel_urls) % 1000 == 0:
-            save_json({'parcels': all_parcel_urls}, "tyler", f"{county}_progress")
-    
-    # Удалить дубликаты
-    all_parcel_urls = list(set(all_parcel_urls))
-    
-    return all_parcel_urls
+    prefixes = list(TYLER_PREFIX_ALPHABET)
+    get_redis().hincrby(f"tyler_enum:{county}", "pending", len(prefixes))
+
+    group(tyler_enumerate_prefix_task.s(search_url, county, prefix, result_cap) for prefix in prefixes)()
+
+    return {'county': county, 'frontier': f"tyler:{county}", 'prefixes': len(prefixes)}
+
+
+@app.task(bind=True, autoretry_for=(Exception,), max_retries=2, retry_backoff=30)
+def tyler_enumerate_prefix_task(self, search_url: str, county: str, prefix: str,
+                                result_cap: int = TYLER_RESULT_CAP) -> int:
+    """
+    Поиск по одному префиксу владельца; обрезанная выдача делится на префиксы длиннее
+    """
+    try:
+        with browser_session() as sb:
+            parcel_urls, truncated = tyler_search(sb, search_url, {'owner_name': f"{prefix}*"}, result_cap)
+            rows = harvest_attr(sb, TYLER_RESULT_ROW_SELECTOR, "text") if truncated else []
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            # Повторов больше не будет: префикс записывается как потерянный, перебор все равно завершается
+            print(f"Tyler {county} '{prefix}*': поиск не удался, префикс пропущен: {e}")
+            r = get_redis()
+            r.rpush(f"tyler_enum:{county}:failed", prefix)
+            _prefix_finished(r, county)
+        raise
+
+    # Даже обрезанная выдача попадает во frontier - повторы отсеются по ключу
+    added = Frontier(f"tyler:{county}").enqueue(parcel_urls, meta={"prefix": prefix})
+    print(f"Tyler {county} '{prefix}*': {len(parcel_urls)} parcels, новых {added}, обрезано: {truncated}")
+
+    r = get_redis()
+    progress_key = f"tyler_enum:{county}"
+
+    if truncated and len(prefix) < TYLER_MAX_PREFIX_LEN:
+        # Алфавит плюс символы, которые реально встретились в именах после префикса
+        chars = TYLER_PREFIX_ALPHABET + " "
+        chars += "".join(sorted(next_chars(rows, prefix) - set(chars)))
+        children = [prefix + char for char in chars]
+        r.hincrby(progress_key, "pending", len(children))
+        group(tyler_enumerate_prefix_task.s(search_url, county, child, result_cap) for child in children)()
+    elif truncated:
+        # Дальше делить некуда - часть parcels может быть потеряна
+        print(f"Tyler {county} '{prefix}*': выдача обрезана и при максимальной длине префикса")
+        r.rpush(f"{progress_key}:truncated", prefix)
+
+    _prefix_finished(r, county)
+    return added
+
+
+def next_chars(rows: list, prefix: str) -> set:
+    """
+    Символы, идущие за префиксом в именах владельцев из строк выдачи (начало ячейки или слова)
+    """
+    pattern = re.compile(r"(?:^|[\t\n|]|\s)" + re.escape(prefix) + r"(.)")
+    return {match.group(1) for row in rows for match in pattern.finditer(row.upper())
+            if match.group(1) not in "*?%\t\n"}
+
+
+def _prefix_finished(r, county: str):
+    """
+    Префикс обработан (успешно или окончательно неудачно); последний сохраняет итоги перебора
+    """
+    progress_key = f"tyler_enum:{county}"
+    if r.hincrby(progress_key, "pending", -1) != 0:
+        return
+    stats = Frontier(f"tyler:{county}").stats()
+    # Непокрытые перебором префиксы: выдача обрезана при максимальной длине или поиск не удался
+    stats['truncated_prefixes'] = r.lrange(f"{progress_key}:truncated", 0, -1)
+    stats['failed_prefixes'] = r.lrange(f"{progress_key}:failed", 0, -1)
+    print(f"Tyler {county}: перебор завершен, frontier: {stats}")
+    save_json(stats, "tyler", f"{county}_enumeration")
+    r.delete(progress_key, f"{progress_key}:truncated", f"{progress_key}:failed")
 
 
 # Пример конфигурации для разных Tyler округов
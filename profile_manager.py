@@ -0,0 +1,131 @@
+"""
+Постоянные профили Chrome (user-data-dir)
+
+Профиль один раз "прогревается" историей посещений (instagram, google, x.com)
+и дальше переиспользуется браузерами всех воркеров хоста. Профиль арендуется
+эксклюзивно через flock, прогрев повторяется раз в PROFILE_REFRESH_INTERVAL,
+а не перед каждой задачей.
+"""
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+PROFILES_DIR = os.environ.get("PROFILES_DIR", "./storage/profiles")
+PROFILE_COUNT = int(os.environ.get("PROFILE_COUNT", 8))
+PROFILE_REFRESH_INTERVAL = int(os.environ.get("PROFILE_REFRESH_INTERVAL", 24 * 3600))
+PROFILE_LEASE_TIMEOUT = 120
+
+WARMUP_URLS = [
+    "https://instagram.com/",
+    "https://google.com/",
+    "https://www.x.com/",
+]
+
+
+class ProfileLease:
+    """
+    Эксклюзивная аренда профиля; освобождается release() или со смертью процесса
+    """
+
+    def __init__(self, index: int, lock_file):
+        self.index = index
+        self.path = os.path.abspath(os.path.join(PROFILES_DIR, f"profile-{index}"))
+        self._lock_file = lock_file
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.path, "taxlien_profile.json")
+
+    def read_meta(self) -> dict:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def needs_warmup(self) -> bool:
+        warmed_at = self.read_meta().get("warmed_at", 0)
+        return time.time() - warmed_at > PROFILE_REFRESH_INTERVAL
+
+    def mark_warmed(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.meta_path, "w", encoding="utf-8") as file:
+            json.dump({"warmed_at": time.time()}, file)
+
+    def release(self):
+        if self._lock_file is None:
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+
+def _try_lease(index: int):
+    lock_file = open(os.path.join(PROFILES_DIR, f"profile-{index}.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return ProfileLease(index, lock_file)
+
+
+def lease_profile(timeout: int = PROFILE_LEASE_TIMEOUT) -> ProfileLease:
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    deadline = time.monotonic() + timeout
+
+    while True:
+        for index in range(PROFILE_COUNT):
+            lease = _try_lease(index)
+            if lease is not None:
+                os.makedirs(lease.path, exist_ok=True)
+                return lease
+
+        if time.monotonic() > deadline:
+            raise TimeoutError("Нет свободных профилей браузера")
+        time.sleep(1)
+
+
+@contextmanager
+def profile_session():
+    lease = lease_profile()
+    try:
+        yield lease
+    finally:
+        lease.release()
+
+
+def warm_up_profile(sb, lease: ProfileLease):
+    """
+    Создать в профиле историю посещений, чтобы браузер выглядел "живым"
+    """
+    print(f"Прогрев профиля {lease.index}")
+    for url in WARMUP_URLS:
+        sb.uc_open_with_reconnect(url, 2)
+    sb.sleep(2)
+    lease.mark_warmed()
+
+
+def ensure_warm(sb, lease: ProfileLease):
+    if lease.needs_warmup():
+        warm_up_profile(sb, lease)
+
+
+def stale_idle_profiles() -> list:
+    """
+    Свободные профили, которым пора обновить прогрев (аренды остаются за вызывающим)
+    """
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    leases = []
+    for index in range(PROFILE_COUNT):
+        lease = _try_lease(index)
+        if lease is None:
+            continue
+        if lease.needs_warmup():
+            leases.append(lease)
+        else:
+            lease.release()
+    return leases
@@ -0,0 +1,167 @@
+"""
+Распределенный ограничитель скорости запросов к сайтам (token bucket в Redis)
+
+Корзина токенов общая для всех воркеров и ведется по ключу хоста (для хостов
+из PER_COUNTY_HOSTS - хост + округ, т.к. там все округа на одном домене).
+Емкость (burst) и скорость пополнения (refill, токенов в секунду) задаются
+по умолчанию и для отдельных хостов. Ответы 429/503 с Retry-After
+блокируют ключ для всех воркеров на указанное время.
+
+Короткое ожидание токена делается на месте, длинное - исключением
+RateLimited, по которому задача перезапускается через retry(countdown=...).
+"""
+
+import email.utils
+import os
+import time
+from urllib.parse import urlparse, parse_qs
+
+import redis
+
+from celery_app import get_redis
+from redis_scripts import script, NOW_MS_LUA
+
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 5))
+RATE_LIMIT_REFILL = float(os.environ.get("RATE_LIMIT_REFILL", 0.5))  # токенов в секунду
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 10))  # дольше - перезапуск задачи
+RATE_LIMIT_DEFAULT_BACKOFF = 60  # сек блокировки после 429 без Retry-After
+
+HOST_RATE_LIMITS = {
+    "qpublic.schneidercorp.com": {"burst": 3, "refill": 0.5},
+    "beacon.schneidercorp.com": {"burst": 3, "refill": 0.5},
+    "www.bid4assets.com": {"burst": 5, "refill": 1.0},
+}
+
+# Хосты, где округа различаются параметром запроса, а не доменом
+PER_COUNTY_HOSTS = {
+    "qpublic.schneidercorp.com": "AppID",
+    "beacon.schneidercorp.com": "AppID",
+}
+
+# KEYS[1] - корзина, KEYS[2] - блокировка по Retry-After; ARGV: burst, refill, cost
+# Возвращает 0, если токен получен, иначе сколько миллисекунд ждать
+TOKEN_BUCKET_LUA = NOW_MS_LUA + """
+local blocked = redis.call('PTTL', KEYS[2])
+if blocked > 0 then return blocked end
+
+local burst = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * refill / 1000)
+
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = math.ceil((cost - tokens) * 1000 / refill)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / refill) + 1000)
+return wait
+"""
+
+
+class RateLimited(Exception):
+    """
+    Токена нет дольше допустимого ожидания; задачу нужно перезапустить через retry_after сек.
+    by_host - ограничение пришло от сайта (429/Retry-After), а не от нашей корзины
+    """
+
+    def __init__(self, key: str, retry_after: float, by_host: bool = False):
+        super().__init__(f"Лимит запросов для {key}, повтор через {retry_after:.0f} сек")
+        self.key = key
+        self.retry_after = retry_after
+        self.by_host = by_host
+
+
+def rate_key(url: str) -> str:
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    param = PER_COUNTY_HOSTS.get(host)
+    if param:
+        county = parse_qs(parsed.query).get(param)
+        if county:
+            return f"{host}:{county[0]}"
+    return host
+
+
+def limits_for(key: str) -> dict:
+    host = key.split(":", 1)[0]
+    limits = HOST_RATE_LIMITS.get(host, {})
+    return {
+        "burst": limits.get("burst", RATE_LIMIT_BURST),
+        "refill": limits.get("refill", RATE_LIMIT_REFILL),
+    }
+
+
+def try_acquire(key: str) -> float:
+    """
+    Взять токен. Возвращает 0 или сколько секунд ждать до следующей попытки
+    """
+    limits = limits_for(key)
+    try:
+        wait_ms = script(TOKEN_BUCKET_LUA)(keys=[f"ratelimit:{key}", f"ratelimit:{key}:blocked"],
+                                           args=[limits["burst"], limits["refill"], 1])
+    except redis.RedisError:
+        # Без Redis не останавливаем работу - ограничение просто не действует
+        return 0
+    return wait_ms / 1000
+
+
+def acquire(url: str, max_wait: float = RATE_LIMIT_MAX_WAIT):
+    """
+    Дождаться токена для запроса к url; если ждать дольше max_wait - RateLimited
+    """
+    key = rate_key(url)
+    waited = 0.0
+    while True:
+        wait = try_acquire(key)
+        if wait <= 0:
+            return
+        if waited + wait > max_wait:
+            raise RateLimited(key, wait)
+        time.sleep(wait)
+        waited += wait
+
+
+def parse_retry_after(value) -> float:
+    if not value:
+        return RATE_LIMIT_DEFAULT_BACKOFF
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return RATE_LIMIT_DEFAULT_BACKOFF
+
+
+def penalize(url: str, retry_after: float):
+    """
+    Сайт попросил притормозить: заблокировать ключ для всех воркеров и обнулить корзину
+    """
+    key = rate_key(url)
+    print(f"Сайт ограничивает запросы ({key}), пауза {retry_after:.0f} сек")
+    try:
+        pipe = get_redis().pipeline()
+        pipe.set(f"ratelimit:{key}:blocked", 1, px=max(1, int(retry_after * 1000)))
+        pipe.hset(f"ratelimit:{key}", "tokens", 0)
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def check_throttled(url: str, response):
+    """
+    429 (или 503 с Retry-After) -> блокировка ключа и RateLimited
+    """
+    retry_after = response.headers.get("Retry-After")
+    if response.status_code == 429 or (response.status_code == 503 and retry_after):
+        delay = parse_retry_after(retry_after)
+        penalize(url, delay)
+        raise RateLimited(rate_key(url), delay, by_host=True)
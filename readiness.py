@@ -0,0 +1,151 @@
+"""
+Ожидание готовности страницы в браузере
+
+Для каждой платформы задается условие готовности: подстрока title, CSS селектор
+и/или JS условие. Ожидание событийное (MutationObserver + readystatechange
+внутри страницы), ограничено бюджетом времени, а captcha кликается только
+когда на странице действительно обнаружен challenge. Время по фазам
+(challenge / loading) возвращается и пишется в лог.
+"""
+
+import logging
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+from canonical import detect_platform
+
+DEFAULT_BUDGET = 45  # сек на одну страницу
+WAIT_SLICE_MS = 1000  # максимум одного ожидания изменения DOM внутри страницы
+
+# title - подстрока заголовка (lower case), selector - CSS, condition - JS выражение
+READINESS = {
+    "qpublic": {"title": "qpublic", "selector": "[id*='ctlBodyPane'], #areaMenuButton", "budget": 60},
+    "beacon": {"selector": "[id*='ctlBodyPane'], #areaMenuButton, form", "budget": 60},
+    "tyler": {"selector": "form", "budget": 30},
+    "bid4assets": {"condition": "document.querySelectorAll('a').length > 10", "budget": 30},
+}
+DEFAULT_READINESS = {"budget": DEFAULT_BUDGET}
+
+# Состояние страницы: 'challenge' | 'ready' | 'loading'
+STATE_FN = """
+function state() {
+    const title = (document.title || '').toLowerCase();
+    if (title.includes('just a moment') ||
+        document.querySelector("iframe[src*='challenges.cloudflare.com'], #challenge-form, #cf-challenge-running")) {
+        return 'challenge';
+    }
+    if (document.readyState !== 'complete') return 'loading';
+    // Пустая страница между навигациями вкладки (tab_fetcher) - еще не запрошенный документ
+    if (location.href === 'about:blank') return 'loading';
+    if (spec.title && !title.includes(spec.title)) return 'loading';
+    if (spec.selector && !document.querySelector(spec.selector)) return 'loading';
+    if (spec.condition && !(new Function('return (' + spec.condition + ');'))()) return 'loading';
+    return 'ready';
+}
+"""
+
+# Если страница еще не готова, ждет первого изменения DOM/readyState (не дольше slice) и проверяет снова
+STATE_JS = """
+const spec = arguments[0];
+const sliceMs = arguments[1];
+const done = arguments[arguments.length - 1];
+""" + STATE_FN + """
+const current = state();
+if (current !== 'loading') { done(current); return; }
+
+let finished = false;
+const finish = () => {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    document.removeEventListener('readystatechange', check);
+    done(state());
+};
+const check = () => { if (state() !== 'loading') finish(); };
+const observer = new MutationObserver(check);
+observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+document.addEventListener('readystatechange', check);
+setTimeout(finish, sliceMs);
+"""
+
+# Мгновенная проверка без ожидания (для опроса нескольких вкладок)
+STATE_NOW_JS = """
+const spec = arguments[0];
+""" + STATE_FN + """
+return state();
+"""
+
+
+class PageNotReadyError(Exception):
+    """
+    Страница не стала готовой за бюджет времени
+    """
+
+    def __init__(self, message: str, timings: dict, state: str = None):
+        super().__init__(message)
+        self.timings = timings
+        self.state = state
+
+
+def _page_state(sb, spec: dict) -> str:
+    try:
+        sb.driver.set_script_timeout(WAIT_SLICE_MS / 1000 + 5)
+        return sb.driver.execute_async_script(STATE_JS, spec, WAIT_SLICE_MS) or "loading"
+    except WebDriverException:
+        # Страница перезагрузилась (например, после прохождения challenge)
+        time.sleep(0.2)
+        return "loading"
+
+
+def readiness_spec(platform: str = None):
+    """
+    JS условие готовности и бюджет времени платформы
+    """
+    spec = READINESS.get(platform, DEFAULT_READINESS)
+    js_spec = {key: spec.get(key) for key in ("title", "selector", "condition")}
+    return js_spec, spec.get("budget", DEFAULT_BUDGET)
+
+
+def page_state_now(sb, js_spec: dict) -> str:
+    try:
+        return sb.driver.execute_script(STATE_NOW_JS, js_spec) or "loading"
+    except WebDriverException:
+        return "loading"
+
+
+def wait_until_ready(sb, platform: str = None, budget: float = None) -> dict:
+    """
+    Дождаться готовности страницы платформы, проходя Cloudflare challenge при необходимости.
+    Возвращает время по фазам, при превышении бюджета - PageNotReadyError
+    """
+    if platform is None:
+        platform = detect_platform(sb.get_current_url())
+    js_spec, default_budget = readiness_spec(platform)
+    budget = budget or default_budget
+
+    timings = {"challenge": 0.0, "loading": 0.0, "captcha_clicks": 0}
+    started = time.monotonic()
+    deadline = started + budget
+
+    while True:
+        phase_started = time.monotonic()
+        state = _page_state(sb, js_spec)
+
+        if state == "ready":
+            timings["total"] = round(time.monotonic() - started, 2)
+            logging.info(f"Страница готова ({platform}): {timings}")
+            return timings
+
+        if state == "challenge":
+            print(f"Passing cloudflare challenge")
+            sb.uc_gui_click_captcha()
+            timings["captcha_clicks"] += 1
+            # Даем challenge отработать: ждем изменения страницы, а не фиксированную паузу
+            _page_state(sb, js_spec)
+
+        timings[state] += time.monotonic() - phase_started
+
+        if time.monotonic() > deadline:
+            timings["total"] = round(time.monotonic() - started, 2)
+            raise PageNotReadyError(f"Страница не готова за {budget} сек ({platform}, {state}): {timings}", timings, state)
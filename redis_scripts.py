@@ -0,0 +1,31 @@
+"""
+Lua скрипты Redis: общая регистрация и фрагменты
+
+Скрипт регистрируется (register_script) один раз на процесс и дальше
+вызывается по SHA (EVALSHA). Время в скриптах берется из Redis (TIME),
+а не у воркера, чтобы часы разных машин не расходились.
+"""
+
+from celery_app import get_redis
+
+# Текущее время в local now: секунды (дробные) и миллисекунды
+NOW_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+"""
+
+NOW_MS_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+_scripts = {}  # исходник -> зарегистрированный скрипт
+
+
+def script(source: str):
+    """
+    Зарегистрированный скрипт для source: вызывается как script(keys=[...], args=[...])
+    """
+    if source not in _scripts:
+        _scripts[source] = get_redis().register_script(source)
+    return _scripts[source]
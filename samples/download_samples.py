@@ -15,17 +15,40 @@ from datetime import datetime
 from typing import List, Dict, Optional
 from urllib.parse import urlparse
 
+# Shared service modules (display_manager etc.) live in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
 try:
     from seleniumbase import SB
-    from sbvirtualdisplay import Display
+    from display_manager import display_session
     SELENIUM_AVAILABLE = True
 except ImportError:
     SELENIUM_AVAILABLE = False
     print("⚠️  SeleniumBase not available. Install with: pip install seleniumbase")
 
-import requests
+try:
+    from clearance import get_host
+    from fetch_engine import get_host_mode, try_http, MODE_BROWSER
+    from outcomes import NotFoundError
+    FETCH_ENGINE_AVAILABLE = True
+except ImportError:
+    # Without celery/redis: plain HTTP, no host mode learning
+    import requests
+    FETCH_ENGINE_AVAILABLE = False
+    print("⚠️  Fetch engine not available (celery/redis missing), using plain HTTP")
+
+    class NotFoundError(Exception):
+        pass
+
 from platform_sample_urls import PlatformURLGenerator, SampleURL
 
+# Plain HTTP fallback only; the fetch engine sends its own headers
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
 
 class SampleDownloader:
     """Download HTML samples from county websites"""
@@ -49,59 +72,61 @@ class SampleDownloader:
         # Download history to avoid duplicates
         self.downloaded = set()
 
+    def http_get(self, url: str, platform: str) -> Optional[str]:
+        """HTML over HTTP, None if the page needs a browser; raises NotFoundError on 404/410"""
+        if FETCH_ENGINE_AVAILABLE:
+            return try_http(url, platform)
+
+        response = requests.get(url, headers=HTTP_HEADERS, timeout=30, allow_redirects=True)
+        if response.status_code in (404, 410):
+            raise NotFoundError(url)
+        return response.text if response.status_code == 200 else None
+
+    def needs_browser(self, url: str) -> bool:
+        """Whether an HTTP failure should escalate to Selenium"""
+        if FETCH_ENGINE_AVAILABLE:
+            return get_host_mode(get_host(url)) == MODE_BROWSER
+        return True
+
     def download_url_simple(self, sample_url: SampleURL, output_path: Path) -> bool:
-        """Download using simple HTTP request"""
+        """Download over HTTP through the production fetch engine (it keeps the host mode)"""
         try:
             print(f"  📥 GET {sample_url.url[:80]}...")
 
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
+            # None: challenge/stub/JS-only page, HTTP error, or the host is known to need a browser
+            html = self.http_get(sample_url.url, sample_url.platform)
+            if html is None:
+                print(f"  ⚠️  No real page over HTTP")
+                return False
+
+            # Save HTML
+            html_file = output_path / f"{sample_url.page_type}_{sample_url.parcel_id.replace('/', '_')}.html"
+            html_file.write_text(html, encoding='utf-8')
+
+            # Save metadata
+            meta = {
+                'url': sample_url.url,
+                'parcel_id': sample_url.parcel_id,
+                'page_type': sample_url.page_type,
+                'platform': sample_url.platform,
+                'county': sample_url.county,
+                'state': sample_url.state,
+                'download_date': datetime.now().isoformat(),
+                'method': 'simple_http',
+                'content_length': len(html),
+                'notes': sample_url.notes
             }
 
-            response = requests.get(sample_url.url, headers=headers, timeout=30, allow_redirects=True)
-
-            if response.status_code == 200:
-                # Basic validation - check HTML contains expected content
-                if len(response.text) < 500:
-                    print(f"  ⚠️  Suspiciously small HTML ({len(response.text)} bytes)")
-
-                if 'error' in response.text.lower() or 'not found' in response.text.lower():
-                    print(f"  ⚠️  Page may contain error message")
-
-                # Save HTML
-                html_file = output_path / f"{sample_url.page_type}_{sample_url.parcel_id.replace('/', '_')}.html"
-                html_file.write_text(response.text, encoding='utf-8')
-
-                # Save metadata
-                meta = {
-                    'url': sample_url.url,
-                    'parcel_id': sample_url.parcel_id,
-                    'page_type': sample_url.page_type,
-                    'platform': sample_url.platform,
-                    'county': sample_url.county,
-                    'state': sample_url.state,
-                    'download_date': datetime.now().isoformat(),
-                    'method': 'simple_http',
-                    'status_code': response.status_code,
-                    'content_length': len(response.text),
-                    'notes': sample_url.notes
-                }
-
-                meta_file = output_path / f"{sample_url.page_type}_{sample_url.parcel_id.replace('/', '_')}_meta.json"
-                with open(meta_file, 'w') as f:
-                    json.dump(meta, f, indent=2)
-
-                print(f"  ✅ Saved {html_file.name} ({len(response.text):,} bytes)")
-                return True
+            meta_file = output_path / f"{sample_url.page_type}_{sample_url.parcel_id.replace('/', '_')}_meta.json"
+            with open(meta_file, 'w') as f:
+                json.dump(meta, f, indent=2)
 
-            else:
-                print(f"  ❌ HTTP {response.status_code}")
-                return False
+            print(f"  ✅ Saved {html_file.name} ({len(html):,} bytes)")
+            return True
 
+        except NotFoundError:
+            print(f"  ❌ Not found (404/410)")
+            return False
         except Exception as e:
             print(f"  ❌ Error: {e}")
             return False
@@ -115,7 +140,7 @@ class SampleDownloader:
         try:
             print(f"  🌐 Selenium GET {sample_url.url[:80]}...")
 
-            with Display(visible=False, size=(1920, 1080)):
+            with display_session():
                 with SB(uc=True, headless2=True) as sb:
                     # Open URL
                     sb.uc_open_with_reconnect(sample_url.url, reconnect_time=3)
@@ -205,11 +230,16 @@ class SampleDownloader:
                 print(f"  ⏭️  Already downloaded in this session")
                 continue
 
-            # Choose download method
-            if use_selenium or sample_url.platform in ['custom_gis', 'qpublic']:
+            # Choose download method: HTTP first, browser only for hosts that need it
+            if use_selenium:
                 success = self.download_url_selenium(sample_url, output_path)
             else:
                 success = self.download_url_simple(sample_url, output_path)
+                # Escalate only when the engine decided the host needs a browser;
+                # 404s and network errors do not change the host mode
+                if not success and SELENIUM_AVAILABLE and self.needs_browser(sample_url.url):
+                    print(f"  ↗️  Escalating to Selenium")
+                    success = self.download_url_selenium(sample_url, output_path)
 
             # Update stats
             self.downloaded.add(url_hash)
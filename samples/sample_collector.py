@@ -15,6 +15,7 @@ Platform Support:
 
 import csv
 import os
+import sys
 import json
 import time
 import random
@@ -23,9 +24,12 @@ from pathlib import Path
 from typing import Dict, List, Optional
 from urllib.parse import urlparse, urljoin
 
+# Shared service modules (display_manager etc.) live in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
 try:
     from seleniumbase import SB
-    from sbvirtualdisplay import Display
+    from display_manager import display_session
     from bs4 import BeautifulSoup
     SELENIUM_AVAILABLE = True
 except ImportError:
@@ -177,7 +181,7 @@ class SampleCollector:
         assessor_url = county.get('Assessor / Appraser', '')
 
         try:
-            with Display(visible=False, size=(1920, 1080)):
+            with display_session():
                 with SB(uc=True, headless2=True) as sb:
                     for parcel_id in parcel_ids:
                         try:
@@ -0,0 +1,147 @@
+"""
+Параллельная загрузка страниц в нескольких вкладках одного браузера
+
+Один прогретый браузер ведет K вкладок: навигация запускается без ожидания
+(window.location), вкладки по кругу опрашиваются на готовность, готовые
+страницы забираются и вкладка сразу получает следующий URL. Параллелизм
+без K копий Chrome в памяти. K настраивается по хосту (TABS_PER_HOST).
+"""
+
+import os
+import time
+
+from celery.exceptions import SoftTimeLimitExceeded
+
+from browser_pool import browser_session
+from canonical import detect_platform
+from clearance import get_host
+from concurrency import current_limit, note_challenge
+from fetch_engine import fetch, get_host_mode, MODE_BROWSER
+from rate_limiter import acquire, RateLimited
+from readiness import readiness_spec, page_state_now
+
+DEFAULT_TABS = int(os.environ.get("DEFAULT_TABS", 3))
+TABS_PER_HOST = {
+    "qpublic.schneidercorp.com": 4,
+    "beacon.schneidercorp.com": 4,
+    "www.bid4assets.com": 4,
+}
+POLL_INTERVAL = 0.1
+
+
+def tabs_for_host(host: str) -> int:
+    return TABS_PER_HOST.get(host, DEFAULT_TABS)
+
+
+def fetch_in_tabs(sb, urls: list, platform: str = None, tabs: int = None, results: dict = None) -> dict:
+    """
+    Загрузить список URL в K вкладках браузера.
+    Возвращает {url: html}; для страниц, не ставших готовыми (challenge, таймаут), html = None.
+    results - словарь для заполнения по мере загрузки (частичный результат при прерывании)
+    """
+    if not urls:
+        return {}
+
+    platform = platform or detect_platform(urls[0])
+    # Не больше вкладок, чем текущий адаптивный лимит хоста (concurrency.py)
+    tabs = min(tabs or tabs_for_host(get_host(urls[0])), current_limit(urls[0]))
+    js_spec, budget = readiness_spec(platform)
+    driver = sb.driver
+
+    handles = [driver.current_window_handle]
+    for _ in range(min(tabs, len(urls)) - 1):
+        driver.switch_to.new_window("tab")
+        handles.append(driver.current_window_handle)
+
+    pending = list(reversed(urls))
+    active = {}  # handle -> (url, started)
+    results = {} if results is None else results
+
+    def start_next(handle):
+        if not pending:
+            active.pop(handle, None)
+            return
+        url = pending.pop()
+        acquire(url)
+        driver.switch_to.window(handle)
+        # Сначала пустая страница: пока новая навигация не применилась, опрос не должен
+        # принять документ предыдущего URL за готовый (readiness не знает, какой URL запрошен)
+        driver.get("about:blank")
+        # Навигация без ожидания загрузки - вкладки грузятся параллельно
+        driver.execute_script("window.location.href = arguments[0];", url)
+        active[handle] = (url, time.monotonic())
+
+    for handle in handles:
+        start_next(handle)
+
+    while active:
+        for handle, (url, started) in list(active.items()):
+            driver.switch_to.window(handle)
+            state = page_state_now(sb, js_spec)
+
+            if state == "ready":
+                results[url] = driver.page_source
+            elif state == "challenge" or time.monotonic() - started > budget:
+                if state == "challenge":
+                    note_challenge(url)
+                # Challenge в фоновой вкладке не проходим - вернем на одиночную загрузку
+                print(f"Вкладка не готова ({state}): {url}")
+                results[url] = None
+            else:
+                continue
+
+            start_next(handle)
+
+        time.sleep(POLL_INTERVAL)
+
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+
+    return results
+
+
+def fetch_many(urls: list, platform: str = None, results: dict = None, errors: dict = None) -> dict:
+    """
+    Загрузить много страниц: хосты в режиме HTTP - по HTTP, остальные - вкладками
+    одного арендованного браузера, неудачные вкладки - одиночным fetch.
+    results заполняется по мере загрузки: при SoftTimeLimitExceeded в нем уже загруженное.
+    Ошибка одного URL не прерывает пачку: его html = None, исключение - в errors[url].
+    Паузы лимитера (RateLimited) и SoftTimeLimitExceeded прерывают всю пачку
+    """
+    results = {} if results is None else results
+    errors = {} if errors is None else errors
+    browser_urls = []
+
+    def fetch_one(url):
+        try:
+            results[url] = fetch(url, platform=platform)
+        except (RateLimited, SoftTimeLimitExceeded):
+            raise
+        except Exception as e:
+            print(f"Не удалось загрузить {url}: {type(e).__name__}: {e}")
+            results[url] = None
+            errors[url] = e
+
+    for url in urls:
+        if get_host_mode(get_host(url)) == MODE_BROWSER:
+            browser_urls.append(url)
+        else:
+            fetch_one(url)
+
+    if browser_urls:
+        try:
+            with browser_session() as sb:
+                fetch_in_tabs(sb, browser_urls, platform, results=results)
+        except (RateLimited, SoftTimeLimitExceeded):
+            raise
+        except Exception as e:
+            # Браузер упал посреди пачки - незагруженное добирается одиночным fetch
+            print(f"Загрузка во вкладках прервана: {type(e).__name__}: {e}")
+
+    for url in browser_urls:
+        if results.get(url) is None:
+            fetch_one(url)
+
+    return results
@@ -1,31 +1,112 @@
 import json
 import logging
+import os
+import random
 from datetime import datetime
 
-from celery import Celery, chain, group
-from celery_app import app
-from functions import get_platforms_urls, save_html, save_csv, save_json, import_to_db, scrape_single_url, generate_name
+from celery import Celery, chain
+from celery.exceptions import SoftTimeLimitExceeded
+from kombu import Queue
+from seleniumbase import SB
+
+from blob_store import put_blob, load_html, prune_blobs
+from celery_app import app, REDIS_URL
+from coalesce import coalesce, InFlight
+from canonical import parcel_id
+from circuit_breaker import circuit, CircuitOpen, breaker_state, breaker_key, CLOSED, BREAKER_PROBE_TIMEOUT
+from concurrency import host_slot, current_limit, NoCapacity
+from display_manager import display_session
+from fetch_engine import fetch, fetch_record
+from frontier import Frontier, all_frontiers
+from outcomes import FetchTask, NotFoundError, ParseFailedError, classify, replay_dead_letters
+from functions import get_platforms_urls, save_html, save_csv, import_to_db, generate_name
+from platforms.beacon.beacon_functions import beacon_scrape_counties_urls_task, beacon_get_all_parcels_urls_task, \
+    beacon_enumerate_county_task
 from platforms.qpublic.qpublic_functions import qpublic_get_all_parcels_urls_task, qpublic_scrape_counties_urls_task, \
     qpublic_parse_single_html_task
+from platforms.tyler_technologies.tyler_functions import tyler_search_by_criteria, tyler_scrape_all_parcels_by_letter, \
+    tyler_enumerate_prefix_task
+from platforms.bid4assets.bid4assets_functions import bid4assets_get_auction_calendar, \
+    bid4assets_get_auction_properties, bid4assets_scrape_full_auction, bid4assets_scrape_auction_properties, \
+    bid4assets_fetch_properties_task, bid4assets_auction_summary_task
+from profile_manager import stale_idle_profiles, warm_up_profile
+from rate_limiter import RateLimited
+from tab_fetcher import fetch_many
+import time_budget  # лимиты времени браузерных задач по замерам (сигналы Celery)
 
 #  -----------------------------------------------------------------------------------------
 #   Конфигурация
 #  -----------------------------------------------------------------------------------------
 
+# Сколько записей frontier раздается за проход диспетчера и сколько может быть в работе одновременно
+FRONTIER_DISPATCH_BATCH = int(os.environ.get('FRONTIER_DISPATCH_BATCH', 100))
+FRONTIER_MAX_INFLIGHT = int(os.environ.get('FRONTIER_MAX_INFLIGHT', 500))
+# Через сколько сек снова пробовать запись, не розданную из-за лимита хоста
+FRONTIER_PARK_DELAY = int(os.environ.get('FRONTIER_PARK_DELAY', 60))
+
+# Сек на запуск процесса воркера до сигнала готовности мастеру
+WORKER_PROC_ALIVE_TIMEOUT = int(os.environ.get('WORKER_PROC_ALIVE_TIMEOUT', 30))
+
+# Сколько хранить итоговые результаты задач в Redis
+RESULT_EXPIRES = int(os.environ.get('RESULT_EXPIRES', 3600 * 24))
+
+# Очереди по классу ресурса: браузер (долгие загрузки), CPU (парсинг), IO (файлы, БД, оркестрация)
+BROWSER_QUEUE = 'browser'
+PARSE_QUEUE = 'parse'
+IO_QUEUE = 'io'
+
+# Шаблоны имен задач -> очередь (проверяются по порядку, остальное уходит в IO_QUEUE)
+TASK_ROUTES = {
+    'tasks.scrape_url_task': {'queue': BROWSER_QUEUE},
+    'tasks.extract_url_task': {'queue': BROWSER_QUEUE},
+    'tasks.scrape_urls_batch_task': {'queue': BROWSER_QUEUE},
+    'tasks.refresh_browser_profiles_task': {'queue': BROWSER_QUEUE},
+    'platforms.*_scrape_counties_urls_task': {'queue': BROWSER_QUEUE},
+    'platforms.*_enumerate_county_task': {'queue': BROWSER_QUEUE},
+    'platforms.*_get_parcel_search_url': {'queue': BROWSER_QUEUE},
+    'platforms.*_search_by_criteria': {'queue': BROWSER_QUEUE},
+    'platforms.*_enumerate_prefix_task': {'queue': BROWSER_QUEUE},
+    'platforms.*_get_auction_calendar': {'queue': BROWSER_QUEUE},
+    'platforms.*_get_auction_properties': {'queue': BROWSER_QUEUE},
+    'platforms.*_fetch_properties_task': {'queue': BROWSER_QUEUE},
+    '*_parse_*': {'queue': PARSE_QUEUE},
+}
+
 app.conf.update(
+    task_queues=(Queue(BROWSER_QUEUE), Queue(PARSE_QUEUE), Queue(IO_QUEUE)),
+    task_default_queue=IO_QUEUE,
+    task_routes=TASK_ROUTES,
+    # Браузерная задача идет 30+ сек: воркер берет следующую только когда освободится,
+    # а задача подтверждается после выполнения (не теряется при падении браузера/воркера)
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # Сколько мастер ждет готовности нового процесса (по умолчанию 4 сек); браузеры пула
+    # стартуют при первой аренде, но импорт платформ и подключение к Redis тоже не мгновенны
+    worker_proc_alive_timeout=WORKER_PROC_ALIVE_TIMEOUT,
     timezone='Europe/Moscow',
     enable_utc=True,
     # result_backend = 'db+sqlite:///results.db',
-    result_backend='redis://localhost:6379/0',  # результаты задач хранятся в Redis
-    result_expires=3600 * 24 * 30,  # результаты задач хранятся 30 дней
-    task_annotations={'*': {'rate_limit': '5/m'}}
-    # ограничение скорости выполнения 2 задач в минуту
+    result_backend=REDIS_URL,  # результаты задач хранятся в Redis
+    # Промежуточные результаты цепочек не сохраняются (ignore_result), а страницы передаются
+    # handle'ами blob_store - в backend остаются только итоговые результаты
+    result_expires=RESULT_EXPIRES,
+    # Скорость запросов к сайтам ограничивается по хосту в rate_limiter.py, а не rate_limit задач
 )
 
 app.autodiscover_tasks()
 
 logging.basicConfig(level=logging.DEBUG, filename="tasks.log", filemode="a")
 
+# Извлекать поля в браузере (extraction.py) вместо передачи всего HTML по цепочке
+EXTRACT_IN_BROWSER = os.environ.get('EXTRACT_IN_BROWSER', '1') == '1'
+# Архивировать сырой HTML асинхронной задачей (вне основной цепочки)
+ARCHIVE_RAW_HTML = os.environ.get('ARCHIVE_RAW_HTML', '1') == '1'
+# Сколько раз задача перезапускается, если сайт/лимитер просит подождать
+RATE_LIMIT_MAX_REQUEUES = int(os.environ.get('RATE_LIMIT_MAX_REQUEUES', 20))
+# Разброс перезапуска задач хоста с открытым breaker, чтобы после пробы они не пришли разом
+BREAKER_JITTER = 60
+
 
 #  -----------------------------------------------------------------------------------------
 #   Периодические задачи
@@ -33,7 +114,13 @@ logging.basicConfig(level=logging.DEBUG, filename="tasks.log", filemode="a")
 
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
-    pass
+    # Обновление прогрева свободных профилей браузера раз в час (только устаревших)
+    sender.add_periodic_task(3600.0, refresh_browser_profiles_task.s(), name='Прогрев профилей браузера',
+                             expires=3600.0)
+    # Раздача записей frontier в обработку (и возврат просроченных аренд) каждую минуту
+    sender.add_periodic_task(60.0, frontier_dispatch_task.s(), name='Диспетчер frontier', expires=60.0)
+    # Удаление старых страниц из blob_store раз в сутки
+    sender.add_periodic_task(24 * 3600.0, prune_blobs_task.s(), name='Очистка blob_store', expires=3600.0)
 
     # Вызывает run_scraping_chain() каждые 30 минут
     # sender.add_periodic_task(30.0 * 60, run_single_url_chain(), name='Запуск цепочки скрапинга', expires=30.0 * 60)
@@ -58,20 +145,13 @@ def setup_periodic_tasks(sender, **kwargs):
 def qpublic_main_chain():
     url = get_platforms_urls()["qpublic"]
 
-    counties_urls = qpublic_scrape_counties_urls_task.s(url).apply_async().get()
-    all_parcels_urls = qpublic_get_all_parcels_urls_task.s(counties_urls).apply_async().get()
-
-    name = generate_name("qpublic", "all_parcels_urls")
-    save_json(all_parcels_urls, "qpublic", name)
-
-    # !!! Урезаем количество url до 10 для теста !!!
-    all_parcels_urls = all_parcels_urls[:10]
-
-    group(qpublic_single_url_chain.s(url) for url in all_parcels_urls)()
+    # Округа -> перебор parcels (задача на округ) -> frontier -> обработка parcels:
+    # каждый шаг запускается колбэком предыдущего, ни одна задача не ждет другую через .get()
+    chain(qpublic_scrape_counties_urls_task.s(url), qpublic_get_all_parcels_urls_task.s())()
 
 
 @app.task
-def qpublic_single_url_chain(url: str):
+def qpublic_single_url_chain(url: str, frontier: str = None, key: str = None):
     platform = "qpublic"
     
     # Валидация входного URL
@@ -79,56 +159,105 @@ def qpublic_single_url_chain(url: str):
         logging.error(f"Некорректный URL: {url}")
         return
     
-    try:
-        # Более детальная логика извлечения parcel_id
-        if "KeyValue=" in url:
-            parcel_id = url.split("KeyValue=")[-1].split("&")[0]  # Убираем параметры после &
-        elif "/" in url:
-            parcel_id = url.split("/")[-1].split("?")[0]  # Убираем query параметры
-        else:
-            parcel_id = url.strip()
-            
-        # Дополнительная очистка parcel_id
-        parcel_id = parcel_id.strip().replace(" ", "")
-        
-    except Exception as e:
-        logging.error(f"Ошибка извлечения parcel_id из URL {url}: {e}")
-        parcel_id = "unknown"
+    # Стабильный ID parcel (canonical.py): те же имена файлов и записи в базе при повторном обходе
+    record_id = parcel_id(url, platform)
     
-    # Улучшенная валидация parcel_id
-    if not parcel_id or parcel_id == "unknown" or len(parcel_id) < 3:
-        parcel_id = f"fallback_{abs(hash(url)) % 10000}"
-    
-    # Проверка на максимальную длину
-    if len(parcel_id) > 100:
-        parcel_id = parcel_id[:100]
-    
-    unique_name = generate_name(platform, parcel_id)
+    unique_name = generate_name(platform, record_id)
+
+    if EXTRACT_IN_BROWSER:
+        # По цепочке идет компактная запись, сырой HTML архивируется отдельно
+        steps = [extract_url_task.s(url, platform=platform, name=unique_name),
+                 import_to_db_task.s(platform=platform, record_id=record_id)]
+    else:
+        steps = [scrape_url_task.s(url), save_html_task.s(platform=platform, name=unique_name),
+                 qpublic_parse_html_task.s(), import_to_db_task.s(platform=platform, record_id=record_id)]
 
-    chain(scrape_url_task.s(url), save_html_task.s(platform=platform, name=unique_name), qpublic_parse_single_html_task.s(),
-          import_to_db_task.s())()
+    if frontier:
+        # Отметить запись frontier по итогу цепочки
+        steps.append(frontier_done_task.si(frontier, key))
+        chain(*steps).apply_async(link_error=frontier_failed_task.s(frontier, key))
+    else:
+        chain(*steps)()
 
 
 #   -----------------------------------------------------------------------------------------
 #   Одиночные задачи для использования внутри цепочек
 #   -----------------------------------------------------------------------------------------
 
-@app.task
-def scrape_url_task(url: str) -> str:
+# Ошибки загрузки и разбора - исключения outcomes: транзитные повторяются FetchTask (autoretry),
+# остальные останавливают цепочку и уходят в dead-letter.
+# Одновременные загрузки одного URL объединяются (coalesce.py): повтор берет результат из кэша
+
+def _fetch_page(url: str) -> dict:
+    with circuit(url), host_slot(url):
+        result = fetch(url)
+    # По цепочке идет handle страницы, а не сам HTML
+    return put_blob(result)
+
+
+def _extract_record(url: str, platform: str, name: str, archive_html: bool) -> dict:
+    with circuit(url), host_slot(url):
+        record, html = fetch_record(url, platform, keep_html=archive_html)
+    if not record or not any(record.values()):
+        raise ParseFailedError("Ни одно поле не извлечено", url)
+    if html is not None:
+        save_html_task.delay(put_blob(html), platform=platform, name=name)
+    return record
+
+
+def _coalesced_fetch(task, kind: str, url: str, produce):
+    """
+    produce() через coalesce с перезапуском задачи по паузам (чужая загрузка, breaker,
+    слоты, лимитер); прочие ошибки - типизированный исход outcomes
+    """
     try:
-        result = scrape_single_url(url)
-        return result
+        return coalesce(kind, url, produce)
+    except InFlight as e:
+        task.requeue(e, e.retry_after)
+    except CircuitOpen as e:
+        # Хост лежит: не запускать браузер до пробы breaker'а
+        task.requeue(e, e.retry_after + random.uniform(0, BREAKER_JITTER))
+    except NoCapacity as e:
+        # Ожидание свободного слота хоста не считается неудачной попыткой
+        task.requeue(e, e.retry_after + random.uniform(0, e.retry_after))
+    except RateLimited as e:
+        task.requeue(e, e.retry_after, max_requeues=RATE_LIMIT_MAX_REQUEUES)
     except Exception as e:
-        error_string = f"Ошибка scrape_single_url:\nURL: {url}\n{e}\n\n"
-        logging.error(error_string)
-        print(error_string)
-        return error_string
+        raise classify(e, url)
 
 
-@app.task
-def save_html_task(html: str, platform: str, name: str) -> str:
+@app.task(bind=True, base=FetchTask, ignore_result=True)
+def scrape_url_task(self, url: str) -> dict:
+    return _coalesced_fetch(self, "page", url, lambda: _fetch_page(url))
+
+
+@app.task(bind=True, base=FetchTask, ignore_result=True)
+def extract_url_task(self, url: str, platform: str, name: str, archive_html: bool = ARCHIVE_RAW_HTML) -> dict:
+    return _coalesced_fetch(self, "record", url, lambda: _extract_record(url, platform, name, archive_html))
+
+
+@app.task(bind=True, max_retries=RATE_LIMIT_MAX_REQUEUES)
+def scrape_urls_batch_task(self, urls: list, platform: str = None) -> dict:
+    """
+    Пачка URL за одну аренду браузера: страницы грузятся параллельно во вкладках.
+    Возвращает {url: handle} (blob_store)
+    """
+    pages = {}
+    try:
+        fetch_many(urls, platform, results=pages)
+    except RateLimited as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
+    except SoftTimeLimitExceeded:
+        # Бюджет времени исчерпан: отдаем уже загруженные страницы
+        time_budget.mark_timed_out()
+        print(f"Бюджет времени исчерпан: загружено {len(pages)} из {len(urls)}")
+    return {url: put_blob(html) if html is not None else None for url, html in pages.items()}
+
+
+@app.task(ignore_result=True)
+def save_html_task(html: dict, platform: str, name: str) -> dict:
     try:
-        save_html(html, platform, name)
+        save_html(load_html(html), platform, name)
         return html
     except Exception as e:
         file_path = f"/storage/{platform}/{name}.html"
@@ -138,19 +267,16 @@ def save_html_task(html: str, platform: str, name: str) -> str:
         return html
 
 
-@app.task
-def qpublic_parse_html_task(html: str) -> dict:
+@app.task(base=FetchTask, ignore_result=True)
+def qpublic_parse_html_task(html: dict) -> dict:
     try:
-        data = qpublic_parse_single_html_task(html)
-        return data
+        return qpublic_parse_single_html_task(html)
     except Exception as e:
-        error_string = f"Ошибка qpublic_parse_html:\n{e}\n\n"
-        logging.error(error_string)
-        print(error_string)
-        return {"error": error_string}
+        # Разметка не та - повтор не поможет, страница уходит в dead-letter
+        raise ParseFailedError(f"{type(e).__name__}: {e}")
 
 
-@app.task
+@app.task(ignore_result=True)
 def save_csv_task(data: dict, platform: str, name: str) -> dict:
     try:
         save_csv(data, platform, name)
@@ -162,13 +288,115 @@ def save_csv_task(data: dict, platform: str, name: str) -> dict:
         return data
 
 
-@app.task
-def import_to_db_task(data: dict) -> str:
+@app.task(ignore_result=True)
+def import_to_db_task(data: dict, platform: str = "qpublic", record_id: str = None) -> str:
     try:
-        import_to_db(data)
+        import_to_db(data, platform, record_id)
         return "Данные импортированы в базу"
     except Exception as e:
         error_string = f"Ошибка import_to_db:\nДанные: {data}\n{e}\n\n"
         logging.error(error_string)
         print(error_string)
-        return f"Ошибка импорта в базу: {error_string}"
+        # Не отмечать запись frontier готовой
+        raise
+
+
+#   -----------------------------------------------------------------------------------------
+#   Frontier
+#   -----------------------------------------------------------------------------------------
+
+# Задача обработки одного URL для frontier платформы (префикс имени frontier до ':')
+FRONTIER_HANDLERS = {
+    "qpublic": qpublic_single_url_chain,
+}
+
+
+@app.task
+def frontier_dispatch_task(name: str = None) -> int:
+    """
+    Взять из frontier пачку записей в аренду и запустить их обработку.
+    Без имени - проход по всем frontier, у которых есть обработчик
+    """
+    dispatched = 0
+    for frontier_name in ([name] if name else all_frontiers()):
+        handler = FRONTIER_HANDLERS.get(frontier_name.split(":")[0])
+        if handler is None:
+            continue
+
+        frontier = Frontier(frontier_name)
+        free = FRONTIER_MAX_INFLIGHT - frontier.stats()["leased"]
+        if free <= 0:
+            continue
+
+        # На хост раздается не больше его текущего лимита одновременных загрузок (concurrency.py)
+        # за вычетом записей, уже отданных в работу: лишние цепочки только крутились бы на NoCapacity,
+        # пока не истечет аренда. Хосты с открытым breaker ждут пробы, в half-open уходит одна запись
+        allowance = {}  # host -> (сколько еще можно раздать, через сколько сек вернуть лишние)
+        for key, url, meta in frontier.lease(min(FRONTIER_DISPATCH_BATCH, free)):
+            host = breaker_key(url)
+            if host not in allowance:
+                load = frontier.host_load(host)
+                state, retry_after = breaker_state(url)
+                if state == CLOSED:
+                    allowance[host] = (current_limit(url) - load, FRONTIER_PARK_DELAY)
+                elif retry_after > 0:
+                    allowance[host] = (0, retry_after)
+                else:
+                    allowance[host] = (1 - load, BREAKER_PROBE_TIMEOUT)
+            left, park_delay = allowance[host]
+            if left <= 0:
+                frontier.park(key, park_delay)
+                continue
+            allowance[host] = (left - 1, park_delay)
+            frontier.track(key, host)
+            handler.delay(url, frontier=frontier_name, key=key)
+            dispatched += 1
+
+    return dispatched
+
+
+@app.task(ignore_result=True)
+def frontier_done_task(frontier: str, key: str):
+    Frontier(frontier).done(key)
+
+
+@app.task(ignore_result=True)
+def frontier_failed_task(request, exc, traceback, frontier: str, key: str):
+    # Отсутствующую страницу повторять бессмысленно
+    Frontier(frontier).fail(key, error=str(exc), final=isinstance(exc, NotFoundError))
+
+
+#   -----------------------------------------------------------------------------------------
+#   Обслуживание
+#   -----------------------------------------------------------------------------------------
+
+@app.task
+def refresh_browser_profiles_task() -> int:
+    leases = stale_idle_profiles()
+    for lease in leases:
+        try:
+            with display_session():
+                with SB(uc=True, headless=False, user_data_dir=lease.path) as sb:
+                    warm_up_profile(sb, lease)
+        except Exception as e:
+            logging.error(f"Ошибка прогрева профиля {lease.index}: {e}")
+        finally:
+            lease.release()
+    return len(leases)
+
+
+@app.task
+def replay_dead_letters_task(limit: int = 100, kind: str = None) -> int:
+    """
+    Повторить неудачные задачи из dead-letter (kind - только один тип исхода, например "blocked")
+    """
+    replayed = replay_dead_letters(limit, kind)
+    print(f"Повторено задач из dead-letter: {replayed}")
+    return replayed
+
+
+@app.task
+def prune_blobs_task() -> int:
+    removed = prune_blobs()
+    print(f"Удалено старых страниц из blob_store: {removed}")
+    return removed
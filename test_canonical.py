@@ -0,0 +1,73 @@
+"""
+Тесты canonical: ключ и ID parcel не должны меняться незаметно - на них
+ключуются frontier, имена файлов и импорт в базу
+"""
+
+import pytest
+
+import canonical
+from canonical import canonical_url, parcel_key, parcel_id
+
+QPUBLIC_URL = ("https://qpublic.schneidercorp.com/Application.aspx"
+               "?AppID=1081&LayerID=26490&PageTypeID=4&PageID=10768&Q=1234&KeyValue=0012")
+BID4ASSETS_URL = "https://www.bid4assets.com/auction/index/1186/item/987654"
+
+
+@pytest.fixture(autouse=True)
+def default_parcel_id_key(monkeypatch):
+    # Ожидаемые ID посчитаны с ключом по умолчанию, PARCEL_ID_KEY окружения не влияет
+    monkeypatch.setattr(canonical, "PARCEL_ID_KEY", b"taxlien-parcel")
+
+
+def test_qpublic_key_from_appid_and_keyvalue():
+    assert parcel_key(QPUBLIC_URL) == "qpublic:1081:0012"
+
+
+def test_qpublic_key_ignores_param_order_case_and_q():
+    variants = [
+        "https://qpublic.schneidercorp.com/Application.aspx"
+        "?KeyValue=0012&Q=99&PageID=10768&PageTypeID=4&LayerID=26490&AppID=1081",
+        "https://QPUBLIC.schneidercorp.com/Application.aspx"
+        "?appid=1081&keyvalue=0012&LayerID=26490&PageTypeID=4&PageID=10768",
+        "https://qpublic.schneidercorp.com/Application.aspx?AppID=1081&KeyValue=00 12#map",
+    ]
+    for url in variants:
+        assert parcel_key(url) == "qpublic:1081:0012"
+        assert parcel_id(url) == parcel_id(QPUBLIC_URL)
+
+
+def test_qpublic_counties_differ():
+    other_county = QPUBLIC_URL.replace("AppID=1081", "AppID=1082")
+    assert parcel_id(other_county) != parcel_id(QPUBLIC_URL)
+
+
+def test_bid4assets_key_from_item_path():
+    assert parcel_key(BID4ASSETS_URL) == "bid4assets:987654"
+    assert parcel_key("https://www.bid4assets.com/item/987654?utm_source=mail") == "bid4assets:987654"
+    assert parcel_key("https://www.bid4assets.com/storefront/Miami") is None
+
+
+def test_canonical_url_normalizes_host_params_and_fragment():
+    url = "HTTPS://WWW.Example.com:443/a/?b=2&a=1&utm_source=x&fbclid=y#frag"
+    assert canonical_url(url) == "https://www.example.com/a?a=1&b=2"
+
+
+def test_canonical_url_drops_platform_params():
+    assert "Q=" not in canonical_url(QPUBLIC_URL)
+    assert canonical_url(QPUBLIC_URL) == canonical_url(QPUBLIC_URL.replace("Q=1234", "Q=5678"))
+
+
+def test_id_falls_back_to_canonical_url():
+    assert parcel_key("https://www.example.com/a?b=2&a=1") is None
+    assert parcel_id("https://www.example.com/a?b=2&a=1") == parcel_id("https://WWW.example.com/a/?a=1&b=2")
+
+
+def test_pinned_digests():
+    # Смена этих значений меняет все ID frontier, файлов и записей в базе
+    assert parcel_id(QPUBLIC_URL) == "7591e5d74b12532e11f7"
+    assert parcel_id(BID4ASSETS_URL) == "c9162e38bfb2a58d49e8"
+
+
+def test_id_depends_on_key(monkeypatch):
+    monkeypatch.setattr(canonical, "PARCEL_ID_KEY", b"other-key")
+    assert parcel_id(QPUBLIC_URL) != "7591e5d74b12532e11f7"
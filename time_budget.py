@@ -0,0 +1,175 @@
+"""
+Адаптивные бюджеты времени браузерных задач
+
+Для каждого типа задачи из TASK_BUDGETS воркер пишет в Redis длительность
+успешных выполнений (task_latency:<task>, последние BUDGET_SAMPLES). Прерванные
+по soft лимиту (mark_timed_out) с частичным результатом не пишутся - иначе лимит
+задает сам себя; прерванные без результата (перебор округа) пишутся как
+цензурированный замер "не меньше": длительность * BUDGET_CENSORED_FACTOR. При
+отправке задачи (before_task_publish) ей проставляются лимиты:
+    soft = перцентиль BUDGET_PERCENTILE * BUDGET_FACTOR (в пределах BUDGET_MIN..BUDGET_MAX),
+           пока замеров меньше BUDGET_MIN_SAMPLES - значение по умолчанию из TASK_BUDGETS
+    hard = soft + BUDGET_GRACE
+Лимиты, заданные явно (apply_async(soft_time_limit=..., time_limit=...)), не меняются.
+
+По soft лимиту задача получает SoftTimeLimitExceeded и сохраняет частичный
+результат (найденные URL, загруженные страницы - остальное возвращается во
+frontier). Если задача висит в вызове браузера и не реагирует, за
+BROWSER_KILL_MARGIN до hard лимита процессы браузера убиваются
+(browser_pool), браузер пересоздается; hard лимит Celery - последняя мера.
+"""
+
+import fnmatch
+import os
+import time
+
+import redis
+from celery import current_task
+from celery.signals import before_task_publish, task_prerun, task_postrun
+
+from celery_app import get_redis
+
+BUDGET_PERCENTILE = float(os.environ.get("BUDGET_PERCENTILE", 0.95))
+BUDGET_FACTOR = float(os.environ.get("BUDGET_FACTOR", 1.5))
+BUDGET_MIN = int(os.environ.get("BUDGET_MIN", 30))  # сек
+BUDGET_MAX = int(os.environ.get("BUDGET_MAX", 3600))  # сек
+BUDGET_GRACE = int(os.environ.get("BUDGET_GRACE", 60))  # сек от soft до hard лимита
+BUDGET_MIN_SAMPLES = int(os.environ.get("BUDGET_MIN_SAMPLES", 20))
+BUDGET_SAMPLES = int(os.environ.get("BUDGET_SAMPLES", 500))
+BUDGET_REFRESH = 300  # сек, как часто процесс перечитывает замеры
+BROWSER_KILL_MARGIN = int(os.environ.get("BROWSER_KILL_MARGIN", 20))
+# Во сколько раз замер прерванного по лимиту выполнения больше его длительности
+BUDGET_CENSORED_FACTOR = float(os.environ.get("BUDGET_CENSORED_FACTOR", 2))
+
+# Перебор parcels одного округа: лимит времени по умолчанию (сек) и число повторов
+COUNTY_ENUM_TIMEOUT = int(os.environ.get("COUNTY_ENUM_TIMEOUT", 900))
+COUNTY_ENUM_RETRIES = int(os.environ.get("COUNTY_ENUM_RETRIES", 2))
+
+# Шаблоны имен задач -> soft лимит по умолчанию (сек), пока нет замеров
+TASK_BUDGETS = {
+    'tasks.scrape_url_task': 180,
+    'tasks.extract_url_task': 180,
+    'tasks.scrape_urls_batch_task': 900,
+    'platforms.*_scrape_counties_urls_task': 600,
+    'platforms.*_enumerate_county_task': COUNTY_ENUM_TIMEOUT,
+    'platforms.*_get_parcel_search_url': 300,
+    'platforms.*_search_by_criteria': 300,
+    'platforms.*_enumerate_prefix_task': 600,
+    'platforms.*_get_auction_calendar': 300,
+    'platforms.*_get_auction_properties': 900,
+    'platforms.*_fetch_properties_task': 900,
+}
+
+_budgets = {}  # task -> (истекает, soft, hard)
+_started = {}  # task_id -> time.monotonic() начала
+_timed_out = {}  # task_id прерванных по soft лимиту -> цензурированный замер (True) или без замера
+
+
+def default_budget(name: str):
+    for pattern, soft in TASK_BUDGETS.items():
+        if fnmatch.fnmatchcase(name, pattern):
+            return soft
+    return None
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def budget_for(name: str):
+    """
+    (soft, hard) лимиты задачи или None, если задача не бюджетируется
+    """
+    soft = default_budget(name)
+    if soft is None:
+        return None
+
+    cached = _budgets.get(name)
+    if cached and cached[0] > time.monotonic():
+        return cached[1:]
+
+    try:
+        samples = [float(value) for value in get_redis().lrange(f"task_latency:{name}", 0, -1)]
+    except redis.RedisError:
+        samples = []
+    if len(samples) >= BUDGET_MIN_SAMPLES:
+        soft = min(BUDGET_MAX, max(BUDGET_MIN, round(percentile(samples, BUDGET_PERCENTILE) * BUDGET_FACTOR)))
+
+    budget = (soft, soft + BUDGET_GRACE)
+    _budgets[name] = (time.monotonic() + BUDGET_REFRESH, *budget)
+    return budget
+
+
+def browser_kill_delay():
+    """
+    Сколько сек текущая задача может держать браузер до принудительного убийства.
+    None - задача без hard лимита
+    """
+    task = current_task
+    if task is None or not task.request.id:
+        return None
+    hard = (task.request.timelimit or (None, None))[0] or task.time_limit
+    if not hard:
+        return None
+    started = _started.get(task.request.id, time.monotonic())
+    return max(0.0, started + hard - BROWSER_KILL_MARGIN - time.monotonic())
+
+
+def mark_timed_out(censored: bool = False):
+    """
+    Текущая задача поймала SoftTimeLimitExceeded: ее длительность - это лимит, а не время работы.
+    Частичный результат - в замеры не попадает; censored (работа не сделана) - пишется с запасом
+    """
+    task = current_task
+    if task is not None and task.request.id:
+        _timed_out[task.request.id] = censored
+
+
+def extended_budget():
+    """
+    (soft, hard) для повтора текущей задачи после таймаута: soft * BUDGET_FACTOR (до BUDGET_MAX)
+    """
+    task = current_task
+    soft = (task.request.timelimit or (None, None))[1] or task.soft_time_limit or default_budget(task.name)
+    soft = min(BUDGET_MAX, round((soft or BUDGET_MIN) * BUDGET_FACTOR))
+    return soft, soft + BUDGET_GRACE
+
+
+@before_task_publish.connect
+def apply_time_budget(sender=None, headers=None, **kwargs):
+    if not headers or any(headers.get("timelimit") or ()):
+        return
+    budget = budget_for(sender)
+    if budget is not None:
+        soft, hard = budget
+        headers["timelimit"] = (hard, soft)
+
+
+@task_prerun.connect
+def start_timer(task_id=None, **kwargs):
+    _started[task_id] = time.monotonic()
+
+
+@task_postrun.connect
+def record_latency(task_id=None, task=None, state=None, **kwargs):
+    started = _started.pop(task_id, None)
+    censored = _timed_out.pop(task_id, None)
+    if started is None or default_budget(task.name) is None:
+        return
+    duration = time.monotonic() - started
+    if censored is not None:
+        if not censored:
+            return
+        # Задача не уложилась и повторяется (state RETRY): реальная длительность больше
+        duration *= BUDGET_CENSORED_FACTOR
+        _budgets.pop(task.name, None)
+    elif state != "SUCCESS":
+        return
+    try:
+        pipe = get_redis().pipeline()
+        pipe.lpush(f"task_latency:{task.name}", round(duration, 2))
+        pipe.ltrim(f"task_latency:{task.name}", 0, BUDGET_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError:
+        pass